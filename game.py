@@ -1,12 +1,37 @@
-import arcade
+import argparse
+import csv
+import hashlib
+import json
 import math
+import os
 import random
+import re
+import sys
+import threading
+import time
+import zlib
+from collections import deque
+from pathlib import Path
+
+from PIL import Image
+
+if "--headless" in sys.argv:
+    os.environ.setdefault("ARCADE_HEADLESS", "1")  # Окно без дисплея (через EGL) — для CI
+HEADLESS = bool(os.environ.get("ARCADE_HEADLESS"))
+
+import arcade
+
+import numpy as np
+import pytiled_parser
 
 from pyglet.graphics import Batch
-from arcade.particles import FadeParticle, Emitter, EmitBurst, EmitInterval, EmitMaintainCount
-from arcade.gui import UIManager, UIFlatButton, UITextureButton, UILabel, UIInputText, UITextArea, UISlider, UIDropdown, \
-    UIMessageBox
-from arcade.gui.widgets.layout import UIAnchorLayout, UIBoxLayout
+from arcade.gl import BufferDescription
+
+if not HEADLESS:
+    # arcade.gui тянет pyglet.input, а тот без дисплея не импортируется — в headless GUI нет
+    from arcade.gui import UIManager, UIFlatButton, UITextureButton, UILabel, UIInputText, UITextArea, UISlider, \
+        UIDropdown, UIMessageBox
+    from arcade.gui.widgets.layout import UIAnchorLayout, UIBoxLayout
 
 TILE_SCALING = 1.0
 SCREEN_WIDTH = 1280
@@ -15,118 +40,785 @@ SCREEN_HEIGHT = 720
 RANDOM_LOOT = ['heal', 'bomb']
 CHANCE = [90, 10]
 
-SPARK_TEX = [
-    arcade.make_soft_circle_texture(12, arcade.color.NEON_GREEN),
-    arcade.make_soft_circle_texture(12, arcade.color.ELECTRIC_LIME),
-    arcade.make_soft_circle_texture(12, arcade.color.ELECTRIC_CYAN),
-    arcade.make_soft_circle_texture(12, arcade.color.SPRING_GREEN),
+FRAME_HISTORY = 600  # Сколько последних кадров помнит профайлер (10 секунд при 60 FPS)
+PROFILE_TRACE = "profile_trace"  # Файлы выгрузки замеров: .json и .csv
+
+PARTICLE_CAP = 3000  # Больше живых частиц одновременно не бывает
+PARTICLE_LOD_MIN = 0.25  # Ниже этой доли частиц эффекты не урезаем
+PARTICLE_TARGET_MS = 1000 / 60  # Целевое время кадра для подстройки детализации
+
+# Всё, что грузим заранее при старте (чтобы в игре не было чтения с диска)
+PRELOAD_TEXTURES = [
+    "laser_1.png", "laser_2.png", "enemy.png", "ufoGreen.png",
+    "hud_keyGreen.png", "hud_heartFull.png", "bomb.png", "p1_stand.png",
+]
+PRELOAD_SOUNDS = [
+    "8bit_bomb_explosion.wav", "gunfire_sfx.wav", "explosion (1).wav",
 ]
-SMOKE_TEX = arcade.make_soft_circle_texture(20, arcade.color.NEON_GREEN, 255, 80)
-PUFF_TEX = arcade.make_soft_circle_texture(12, arcade.color.WHITE, 255, 50)
+MUSIC_TRACK = "ruskerdax_-_savage_ambush.mp3"  # Не предзагружаем: играет потоком (см. AudioMixer)
+BOOM_TEX_SIZE = 64
+
+# Ёмкости пулов снарядов (больше этого одновременно в мире не бывает)
+BULLET_POOL_SIZE = 1024
+BOMB_POOL_SIZE = 32
+BOOM_POOL_SIZE = 128
+
+# Симуляция идёт фиксированными шагами независимо от частоты отрисовки
+SIM_RATE = 60
+SIM_DT = 1 / SIM_RATE
+MAX_SIM_STEPS = 5  # Больше шагов за кадр не догоняем — иначе «спираль смерти»
+
+BULLET_LIFETIME = 5.0  # Сколько секунд живёт пуля, даже если ни во что не попала
+OWNER_IDS = {"player": 0, "enemy": 1, "boss": 2}
+
+ZONE_CELL = 560  # Клетка сетки зон активности (8 тайлов)
+ZONE_ACTIVE = 700  # Ближе — актёр обновляется каждый шаг (экран плюс запас)
+ZONE_NEAR = 1400  # Ближе — раз в ZONE_NEAR_EVERY шагов; дальше актёр спит
+ZONE_NEAR_EVERY = 4
+ACTOR_CAPACITY = 256  # Начальный размер ActorStore (растёт вдвое по мере надобности)
+TILE_DOOR, TILE_BARREL, TILE_CHEST, TILE_EXIT = 1, 2, 3, 4
+TILE_KINDS = {"doors": TILE_DOOR, "barrel": TILE_BARREL, "chests": TILE_CHEST, "exit": TILE_EXIT}  # Слой -> вид в TileState
+EVENT_CAPACITY = 2048  # Столько событий EventBus держит за шаг (лишние теряются и считаются)
+EV_DAMAGE, EV_PICKUP, EV_EXPLOSION, EV_DEATH, EV_SOUND = range(5)
+EVENT_NAMES = ("damage", "pickup", "explosion", "death", "sound")
+TARGET_PLAYER = -1  # Получатель урона — игрок (иначе слот ActorStore)
+SOUND_BOOM, SOUND_SHOT, SOUND_ENEMY_DEAD = range(3)
+EVENT_SOUNDS = [  # Номер звука в событии -> (файл, громкость)
+    ("8bit_bomb_explosion.wav", 1.0),
+    ("gunfire_sfx.wav", 0.3),
+    ("explosion (1).wav", 0.5),
+]
+MAX_VOICES = 16  # Больше эффектов одновременно не звучит
+SOUND_VOICES = {  # Номер звука -> (сколько копий звучит сразу, приоритет при нехватке голосов)
+    SOUND_BOOM: (4, 2),
+    SOUND_SHOT: (3, 1),
+    SOUND_ENEMY_DEAD: (4, 3),
+}
+TURREL_RANGE = 600  # Дальше турель игрока не замечает
+AI_THINK_INTERVAL = 0.2  # Как часто актёр просит пересчитать видимость и путь
+AI_BUDGET_MS = 1.0  # Столько времени за шаг отдаём очереди ИИ
+AI_JOBS_PER_STEP = 24  # И не больше стольких задач за шаг
+CHUNK_TILES = 16  # Сторона чанка статичной геометрии в тайлах
+BROADPHASE_CELL = 140  # Размер клетки динамической сетки (два тайла)
+FLOW_MAX_STEPS = 16  # Дальше этого числа клеток от игрока поле путей не считаем
+FLOW_WAVES_PER_STEP = 64  # Столько волн BFS за шаг, остальное — в следующих шагах
+
+LEVEL_CACHE_DIR = "level_cache"  # Скомпилированные карты (см. LevelCompiler)
+LEVEL_FORMAT = 3  # Поменялся формат кэша — увеличь, и карты перекомпилируются
+LEVEL_BUILD_BUDGET_MS = 3.0  # Столько за кадр главный поток достраивает спрайты следующего уровня
+LEVEL_BUILD_BATCH = 64  # Спрайтов между проверками бюджета
+SPAWN_LAYERS = ["enemy", "boss", "turrel", "barrel", "chests", "exit"]
+ACTOR_LAYERS = ["enemy", "boss", "turrel"]  # Из этих слоёв спрайты не создаём — только точки спавна
+TILE_FLIP_FLAGS = 0xE0000000  # Биты отражения в gid (Tiled)
+
+# Соседние клетки: сначала прямые, потом диагонали
+NEIGHBOURS = [(1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1)]
+
+
+class FrameProfiler:
+    # Замеры этапов кадра: begin() в начале, lap("имя") после каждого этапа,
+    # end_frame() в конце кадра. Хранит историю кадров для перцентилей и выгрузки.
+    def __init__(self, history=FRAME_HISTORY):
+        self.totals = {}
+        self.calls = {}
+        self.current = {}  # Этапы текущего кадра, мс
+        self.counters = {}  # Счётчики кадра: сущности, частицы, вызовы отрисовки
+        self.frame_times = deque(maxlen=history)
+        self.trace = deque(maxlen=history)
+        self._last = 0.0
+        self._frame_start = time.perf_counter()
+
+    def begin(self):
+        self._last = time.perf_counter()
+
+    def lap(self, name):
+        now = time.perf_counter()
+        elapsed = now - self._last
+        self.totals[name] = self.totals.get(name, 0.0) + elapsed
+        self.calls[name] = self.calls.get(name, 0) + 1
+        self.current[name] = self.current.get(name, 0.0) + elapsed * 1000
+        self._last = now
+
+    def count(self, name, value):
+        self.counters[name] = value
+
+    def add(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def end_frame(self):
+        now = time.perf_counter()
+        frame_ms = (now - self._frame_start) * 1000
+        self._frame_start = now
+        self.frame_times.append(frame_ms)
+        record = {"frame_ms": round(frame_ms, 3)}
+        record.update({name: round(ms, 3) for name, ms in self.current.items()})
+        record.update(self.counters)
+        self.trace.append(record)
+        self.current = {}
+
+    def percentiles(self):
+        if not self.frame_times:
+            return {"p50": 0.0, "p95": 0.0, "p99": 0.0}
+        p50, p95, p99 = np.percentile(np.fromiter(self.frame_times, dtype=float), [50, 95, 99])
+        return {"p50": round(float(p50), 3), "p95": round(float(p95), 3), "p99": round(float(p99), 3)}
+
+    def report(self):
+        return {
+            name: {
+                "total_ms": round(total * 1000, 3),
+                "avg_ms": round(total * 1000 / self.calls[name], 4),
+            }
+            for name, total in self.totals.items()
+        }
+
+    def overlay_text(self):
+        lines = ["frame ms  p50 {p50:.2f}  p95 {p95:.2f}  p99 {p99:.2f}".format(**self.percentiles())]
+        last = self.trace[-1] if self.trace else {}
+        for name in self.totals:
+            lines.append(f"{name:<12} {last.get(name, 0.0):7.3f} ms")
+        for name, value in self.counters.items():
+            lines.append(f"{name:<12} {value}")
+        return "\n".join(lines)
+
+    def dump(self, path=PROFILE_TRACE):
+        # Последние кадры целиком + сводка: JSON для скриптов, CSV для таблиц
+        with open(path + ".json", "w", encoding="utf-8") as f:
+            json.dump({
+                "percentiles": self.percentiles(),
+                "subsystems": self.report(),
+                "frames": list(self.trace),
+            }, f, indent=1)
+        columns = []
+        for record in self.trace:
+            columns.extend(name for name in record if name not in columns)
+        with open(path + ".csv", "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(self.trace)
+
+
+class AssetCache:
+    # Общий кэш текстур и звуков: каждый файл грузится один раз на весь процесс
+    def __init__(self):
+        self.textures = {}
+        self.sounds = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, storage, key, loader):
+        asset = storage.get(key)
+        if asset is None:
+            self.misses += 1
+            asset = loader()
+            storage[key] = asset
+        else:
+            self.hits += 1
+        return asset
+
+    def texture(self, path):
+        return self._get(self.textures, path, lambda: arcade.load_texture(path))
+
+    def soft_circle(self, size, color, center_alpha=255, outer_alpha=0):
+        # Ключ — все параметры генерации, а не только размер
+        key = ("soft_circle", size, tuple(color), center_alpha, outer_alpha)
+        return self._get(self.textures, key,
+                         lambda: arcade.make_soft_circle_texture(size, color, center_alpha, outer_alpha))
+
+    def sound(self, path):
+        return self._get(self.sounds, path, lambda: arcade.load_sound(path))
+
+    def preload(self):
+        for path in PRELOAD_TEXTURES:
+            self.texture(path)
+        for path in PRELOAD_SOUNDS:
+            self.sound(path)
+        self.soft_circle(BOOM_TEX_SIZE, arcade.color.NEON_GREEN)
+
+    def stats(self):
+        return {
+            "textures": len(self.textures),
+            "sounds": len(self.sounds),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
 
 
-def gravity_drag(p):  # Для искр: чуть вниз и затухание скорости
-    p.change_y += -0.03
-    p.change_x *= 0.92
-    p.change_y *= 0.92
+ASSETS = AssetCache()
+
+
+# Внешний вид частиц — мягкий круг: (диаметр, r, g, b, альфа в центре, альфа на краю).
+# Текстуры не нужны: круг с затуханием к краю рисует шейдер ParticleSystem.
+def soft_look(diameter, color, center_alpha=255, outer_alpha=0):
+    return (diameter, color[0] / 255, color[1] / 255, color[2] / 255, center_alpha / 255, outer_alpha / 255)
+
+
+PARTICLE_LOOKS = np.array([
+    soft_look(12, arcade.color.NEON_GREEN),
+    soft_look(12, arcade.color.ELECTRIC_LIME),
+    soft_look(12, arcade.color.ELECTRIC_CYAN),
+    soft_look(12, arcade.color.SPRING_GREEN),
+    soft_look(20, arcade.color.NEON_GREEN, 255, 80),
+    soft_look(12, arcade.color.WHITE, 255, 50),
+], dtype=np.float32)
+SPARK_LOOKS = np.array([0, 1, 2, 3])
+SMOKE_LOOK = 4
+PUFF_LOOK = 5
+
+PARTICLE_VS = """
+#version 330
+
+uniform WindowBlock {
+    mat4 projection;
+    mat4 view;
+} window;
+
+in vec2 in_vert;
+in vec2 in_pos;
+in float in_size;
+in vec4 in_color;
+in vec2 in_soft;
+
+out vec2 v_uv;
+out vec4 v_color;
+out vec2 v_soft;
+
+void main() {
+    v_uv = in_vert * 2.0;
+    v_color = in_color;
+    v_soft = in_soft;
+    gl_Position = window.projection * window.view * vec4(in_pos + in_vert * in_size, 0.0, 1.0);
+}
+"""
+
+PARTICLE_FS = """
+#version 330
+
+in vec2 v_uv;
+in vec4 v_color;
+in vec2 v_soft;
+
+out vec4 f_color;
+
+void main() {
+    float d = length(v_uv);
+    if (d > 1.0) {
+        discard;
+    }
+    // Как make_soft_circle_texture: альфа линейно падает от центра к краю
+    f_color = vec4(v_color.rgb, v_color.a * mix(v_soft.x, v_soft.y, d));
+}
+"""
+
+
+class ParticleBudget:
+    # Общий лимит частиц и уровень детализации эффектов (LOD).
+    # Фабрики эмиттеров спрашивают grant() сколько частиц можно выпустить;
+    # при медленных кадрах LOD снижается: меньше частиц, короче жизнь, реже дым.
+    def __init__(self, cap=PARTICLE_CAP, target_ms=PARTICLE_TARGET_MS):
+        self.cap = cap
+        self.target_ms = target_ms
+        self.live = 0
+        self.lod = 1.0
+        self.requested = 0
+        self.granted = 0
+
+    def observe(self, live, frame_ms):
+        # Раз в кадр: сколько частиц реально живо и как быстро прошёл кадр
+        self.live = live
+        if frame_ms > self.target_ms * 1.25:
+            self.lod = max(PARTICLE_LOD_MIN, self.lod * 0.9)
+        elif frame_ms < self.target_ms * 1.05:
+            self.lod = min(1.0, self.lod + 0.02)
+
+    def grant(self, count):
+        self.requested += count
+        allowed = max(0, min(int(count * self.lod), self.cap - self.live))
+        self.live += allowed  # Резервируем сразу: в кадре может быть несколько взрывов
+        self.granted += allowed
+        return allowed
+
+    def lifetime_scale(self):
+        return 0.5 + 0.5 * self.lod
+
+    def smoke_every(self):
+        # Через сколько шагов взрыв выпускает очередной клуб дыма (клубы сливаются)
+        return 1 + int((1.0 - self.lod) * 6)
+
+    def stats(self):
+        return {
+            "cap": self.cap,
+            "live": self.live,
+            "lod": round(self.lod, 2),
+            "requested": self.requested,
+            "granted": self.granted,
+        }
 
 
-def smoke_mutator(p):  # Дым раздувается и плавно исчезает
-    p.scale_x *= 1.02
-    p.scale_y *= 1.02
-    p.alpha = max(0, p.alpha - 2)
+PARTICLE_BUDGET = ParticleBudget()
+
+
+# Мутаторы работают сразу над всеми частицами своего вида (mask — какие строки массива)
+def gravity_drag(vel, scale, mask):  # Для искр: чуть вниз и затухание скорости
+    vel[mask, 1] -= 0.03
+    vel[mask] *= 0.92
+
+
+def smoke_mutator(vel, scale, mask):  # Дым раздувается (гаснет он сам, по времени жизни)
+    scale[mask] *= 1.02
+
+
+MUTATORS = (None, gravity_drag, smoke_mutator)  # Номер в кортеже хранится у каждой частицы
+
+
+def rand_in_circle(rng, n, radius):
+    # Как arcade.math.rand_in_circle, но сразу n векторов
+    angle = rng.uniform(0.0, 2 * math.pi, n)
+    r = radius * np.sqrt(rng.random(n))
+    return np.column_stack((r * np.cos(angle), r * np.sin(angle)))
+
+
+def rand_on_circle(rng, n, radius):
+    angle = rng.uniform(0.0, 2 * math.pi, n)
+    return np.column_stack((radius * np.cos(angle), radius * np.sin(angle)))
+
+
+class ParticleSystem:
+    # Все частицы всех эмиттеров лежат в одних массивах NumPy (живые — в [0:count)).
+    # Движение, мутаторы и затухание считаются разом для всего массива, умершие
+    # вычищаются сдвигом живых в начало, а рисуется всё одним вызовом: инстансинг
+    # квадратов, мягкий круг дорисовывает шейдер.
+    def __init__(self, capacity=PARTICLE_CAP):
+        self.capacity = capacity
+        self.pos = np.zeros((capacity, 2), dtype=np.float32)
+        self.vel = np.zeros((capacity, 2), dtype=np.float32)
+        self.age = np.zeros(capacity, dtype=np.float32)
+        self.lifetime = np.ones(capacity, dtype=np.float32)
+        self.alpha = np.zeros(capacity, dtype=np.float32)  # Начальная; к концу жизни падает до нуля
+        self.scale = np.zeros(capacity, dtype=np.float32)
+        self.look = np.zeros(capacity, dtype=np.int8)
+        self.mutator = np.zeros(capacity, dtype=np.int8)
+        self.owner = np.zeros(capacity, dtype=np.int64)  # id эмиттера
+        self.arrays = (self.pos, self.vel, self.age, self.lifetime, self.alpha, self.scale,
+                       self.look, self.mutator, self.owner)
+        self.instances = np.zeros((capacity, 9), dtype=np.float32)  # То, что уходит в видеопамять
+        self.count = 0
+        self.counts = {}  # id эмиттера -> сколько его частиц живо
+        self.spawned = 0
+        self.dropped = 0
+        self.program = None
+        self.geometry = None
+        self.buffer = None
+        self.rng = np.random.default_rng()
+
+    def clear(self):
+        # Новый экран — чистый лист. Зерно берём из random, чтобы headless-прогон повторялся
+        self.count = 0
+        self.counts = {}
+        self.rng = np.random.default_rng(random.getrandbits(32))
+
+    def spawn(self, owner, x, y, vel, lifetime, start_alpha, scale, look, mutator=None):
+        total = len(lifetime)
+        n = min(total, self.capacity - self.count)
+        self.dropped += total - n
+        if n <= 0:
+            return 0
+
+        def first(value):
+            return value[:n] if isinstance(value, np.ndarray) else value
+
+        s = slice(self.count, self.count + n)
+        self.pos[s] = (x, y)
+        self.vel[s] = first(vel)
+        self.age[s] = 0.0
+        self.lifetime[s] = first(lifetime)
+        self.alpha[s] = np.asarray(first(start_alpha)) / 255
+        self.scale[s] = first(scale)
+        self.look[s] = first(look)
+        self.mutator[s] = MUTATORS.index(mutator)
+        self.owner[s] = owner
+        self.count += n
+        self.spawned += n
+        return n
+
+    def step(self, dt):
+        n = self.count
+        # Порядок как у arcade: сдвиг (за вызов, без умножения на dt), мутатор, возраст
+        self.pos[:n] += self.vel[:n]
+        for kind, mutate in enumerate(MUTATORS):
+            if mutate is not None:
+                mask = self.mutator[:n] == kind
+                if mask.any():
+                    mutate(self.vel[:n], self.scale[:n], mask)
+        self.age[:n] += dt
+        self._keep(self.age[:n] < self.lifetime[:n])
+
+    def kill(self, owner):
+        # Убрать частицы одного эмиттера (например, выключили след)
+        self._keep(self.owner[:self.count] != owner)
+
+    def _keep(self, alive):
+        if not alive.all():
+            keep = np.flatnonzero(alive)
+            for array in self.arrays:
+                array[:len(keep)] = array[keep]
+            self.count = len(keep)
+        ids, counts = np.unique(self.owner[:self.count], return_counts=True)
+        self.counts = dict(zip(ids.tolist(), counts.tolist()))
+
+    def draw(self):
+        # Возвращает число вызовов отрисовки (0 или 1)
+        n = self.count
+        if n == 0:
+            return 0
+        ctx = arcade.get_window().ctx
+        if self.program is None:
+            self.program = ctx.program(vertex_shader=PARTICLE_VS, fragment_shader=PARTICLE_FS)
+            quad = np.array([-0.5, -0.5, 0.5, -0.5, -0.5, 0.5, 0.5, 0.5], dtype=np.float32)
+            self.buffer = ctx.buffer(reserve=self.instances.nbytes)
+            self.geometry = ctx.geometry([
+                BufferDescription(ctx.buffer(data=quad.tobytes()), "2f", ["in_vert"]),
+                BufferDescription(self.buffer, "2f 1f 4f 2f", ["in_pos", "in_size", "in_color", "in_soft"],
+                                  instanced=True),
+            ])
+        looks = PARTICLE_LOOKS[self.look[:n]]
+        data = self.instances[:n]
+        data[:, 0:2] = self.pos[:n]
+        data[:, 2] = looks[:, 0] * self.scale[:n]
+        data[:, 3:6] = looks[:, 1:4]
+        data[:, 6] = self.alpha[:n] * np.clip(1.0 - self.age[:n] / self.lifetime[:n], 0.0, 1.0)
+        data[:, 7:9] = looks[:, 4:6]
+        self.buffer.write(data.tobytes())
+        ctx.enable(ctx.BLEND)
+        ctx.blend_func = ctx.BLEND_DEFAULT
+        self.geometry.render(self.program, mode=ctx.TRIANGLE_STRIP, instances=n)
+        return 1
+
+    def stats(self):
+        return {
+            "live": self.count,
+            "capacity": self.capacity,
+            "emitters": len(self.counts),
+            "spawned": self.spawned,
+            "dropped": self.dropped,
+        }
 
 
-# Фабрики эмиттеров (возвращают готовый Emitter)
+PARTICLES = ParticleSystem()
+
+
+class ParticleEmitter:
+    # Замена arcade Emitter с тем же интерфейсом (update / draw / can_reap / get_count),
+    # только частицы — не отдельные объекты, а строки в общем ParticleSystem.
+    # mode: "burst" — разово amount штук, "interval" — по штуке раз в amount секунд,
+    # "maintain" — держим amount живых частиц.
+    next_id = 0
+
+    def __init__(self, center_xy, mode, amount, make, system=None):
+        ParticleEmitter.next_id += 1
+        self.id = ParticleEmitter.next_id
+        self.center_x, self.center_y = center_xy
+        self.mode = mode
+        self.amount = amount
+        self.make = make  # make(rng, n) -> параметры n частиц для ParticleSystem.spawn
+        self.system = system or PARTICLES
+        self.carryover = 0.0
+        self.done = False
+        self.slot = None  # Индекс в EmitterManager
+        self.attached = None  # Спрайт, за которым ходит эмиттер
+
+    def how_many(self, dt):
+        if self.mode == "burst":
+            if self.done:
+                return 0
+            self.done = True
+            return self.amount
+        if self.mode == "interval":
+            self.carryover += dt
+            count = int(self.carryover // self.amount)
+            self.carryover -= count * self.amount
+            return count
+        return max(0, self.amount - self.get_count())
+
+    def update(self, dt=1 / 60):
+        # Только выпускаем новые частицы; двигает их ParticleSystem.step
+        count = self.how_many(dt)
+        if count > 0:
+            self.system.spawn(self.id, self.center_x, self.center_y, **self.make(self.system.rng, count))
+
+    def draw(self):
+        pass  # Все частицы рисует ParticleSystem.draw одним вызовом
+
+    def get_count(self):
+        return self.system.counts.get(self.id, 0)
+
+    def can_reap(self):
+        return self.mode == "burst" and self.done and self.get_count() == 0
+
+
+class EmitterManager:
+    # Живые эмиттеры в плотном списке; каждый помнит свой индекс (emitter.slot),
+    # поэтому убрать эмиттер — O(1): на его место переезжает последний.
+    # Эмиттеры, добавленные посреди update, начинают работать со следующего шага.
+    def __init__(self, system=None):
+        self.system = system or PARTICLES
+        self.items = []
+        self.spawned = 0
+        self.retired = 0
+        self.high_water = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def spawn(self, emitter, attach=None):
+        if attach is not None:
+            emitter.attached = attach  # Центр эмиттера каждый шаг прижимается к спрайту
+        emitter.slot = len(self.items)
+        self.items.append(emitter)
+        self.spawned += 1
+        self.high_water = max(self.high_water, len(self.items))
+        return emitter
+
+    def retire(self, emitter, kill_particles=True):
+        slot = emitter.slot
+        if slot is None:
+            return  # Уже убран
+        last = self.items.pop()
+        if last is not emitter:
+            self.items[slot] = last
+            last.slot = slot
+        emitter.slot = None
+        self.retired += 1
+        if kill_particles:
+            self.system.kill(emitter.id)
+
+    def update(self, dt):
+        items = self.items
+        for i in range(len(items)):
+            e = items[i]
+            if e.attached is not None:
+                e.center_x = e.attached.center_x
+                e.center_y = e.attached.center_y
+            e.update(dt)
+        self.system.step(dt)  # Все частицы всех эмиттеров — одним проходом
+        # Идём с конца: на место убранного приезжает уже проверенный эмиттер
+        for i in range(len(items) - 1, -1, -1):
+            if items[i].can_reap():  # Готов к уборке?
+                self.retire(items[i], kill_particles=False)
+
+    def draw(self):
+        return self.system.draw()
+
+    def clear(self):
+        for e in self.items:
+            e.slot = None
+        self.retired += len(self.items)
+        self.items.clear()
+        self.system.clear()
+
+    def stats(self):
+        modes = {}
+        for e in self.items:
+            modes[e.mode] = modes.get(e.mode, 0) + 1
+        return {
+            "live": len(self.items),
+            "high_water": self.high_water,
+            "spawned": self.spawned,
+            "retired": self.retired,
+            "modes": modes,
+        }
+
+
+# Фабрики эмиттеров (возвращают готовый ParticleEmitter)
 def make_explosion(x, y, count=80):
     # Разовый взрыв с искрами во все стороны
-    return Emitter(
+    life = PARTICLE_BUDGET.lifetime_scale()
+    return ParticleEmitter(
         center_xy=(x, y),
-        emit_controller=EmitBurst(count),
-        particle_factory=lambda e: FadeParticle(
-            filename_or_texture=random.choice(SPARK_TEX),
-            change_xy=arcade.math.rand_in_circle((0.0, 0.0), 9.0),
-            lifetime=random.uniform(0.5, 1.1),
-            start_alpha=255, end_alpha=0,
-            scale=random.uniform(0.35, 0.6),
-            mutation_callback=gravity_drag,
+        mode="burst", amount=PARTICLE_BUDGET.grant(count),
+        make=lambda rng, n: dict(
+            look=rng.choice(SPARK_LOOKS, n),
+            vel=rand_in_circle(rng, n, 9.0),
+            lifetime=rng.uniform(0.5, 1.1, n) * life,
+            start_alpha=255,
+            scale=rng.uniform(0.35, 0.6, n),
+            mutator=gravity_drag,
         ),
     )
 
 
 def make_ring(x, y, count=40, radius=5.0):
     # Кольцо искр (векторы направлены по окружности)
-    return Emitter(
+    life = PARTICLE_BUDGET.lifetime_scale()
+    return ParticleEmitter(
         center_xy=(x, y),
-        emit_controller=EmitBurst(count),
-        particle_factory=lambda e: FadeParticle(
-            filename_or_texture=random.choice(SPARK_TEX),
-            change_xy=arcade.math.rand_on_circle((0.0, 0.0), radius),
-            lifetime=random.uniform(0.8, 1.4),
-            start_alpha=255, end_alpha=0,
-            scale=random.uniform(0.4, 0.7),
-            mutation_callback=gravity_drag,
+        mode="burst", amount=PARTICLE_BUDGET.grant(count),
+        make=lambda rng, n: dict(
+            look=rng.choice(SPARK_LOOKS, n),
+            vel=rand_on_circle(rng, n, radius),
+            lifetime=rng.uniform(0.8, 1.4, n) * life,
+            start_alpha=255,
+            scale=rng.uniform(0.4, 0.7, n),
+            mutator=gravity_drag,
         ),
     )
 
 
 def make_fountain(x, y):
     # Фонтанчик: равномерный «дождик» вверх, бесконечно
-    return Emitter(
+    life = PARTICLE_BUDGET.lifetime_scale()
+    return ParticleEmitter(
         center_xy=(x, y),
-        emit_controller=EmitInterval(0.02),  # Непрерывный поток
-        particle_factory=lambda e: FadeParticle(
-            filename_or_texture=PUFF_TEX,
-            change_xy=(random.uniform(-0.8, 0.8), random.uniform(4.0, 6.0)),
-            lifetime=random.uniform(0.8, 1.6),
-            start_alpha=240, end_alpha=0,
-            scale=random.uniform(0.4, 0.8),
-            mutation_callback=gravity_drag,
+        mode="interval", amount=0.02,  # Непрерывный поток
+        make=lambda rng, n: dict(
+            look=PUFF_LOOK,
+            vel=np.column_stack((rng.uniform(-0.8, 0.8, n), rng.uniform(4.0, 6.0, n))),
+            lifetime=rng.uniform(0.8, 1.6, n) * life,
+            start_alpha=240,
+            scale=rng.uniform(0.4, 0.8, n),
+            mutator=gravity_drag,
         ),
     )
 
 
-def make_smoke_puff(x, y):
-    # Короткий «пых» дыма: медленно плывёт и распухает
-    return Emitter(
+def make_smoke_puff(x, y, merged=1):
+    # Короткий «пых» дыма: медленно плывёт и распухает.
+    # merged — сколько клубов слито в один (при нехватке бюджета): он крупнее.
+    life = PARTICLE_BUDGET.lifetime_scale()
+    size = min(2.0, 1.0 + 0.25 * (merged - 1))
+    return ParticleEmitter(
         center_xy=(x, y),
-        emit_controller=EmitBurst(12),
-        particle_factory=lambda e: FadeParticle(
-            filename_or_texture=SMOKE_TEX,
-            change_xy=arcade.math.rand_in_circle((0.0, 0.0), 0.6),
-            lifetime=random.uniform(1.5, 2.5),
-            start_alpha=200, end_alpha=0,
-            scale=random.uniform(0.6, 0.9),
-            mutation_callback=smoke_mutator,
+        mode="burst", amount=PARTICLE_BUDGET.grant(12),
+        make=lambda rng, n: dict(
+            look=SMOKE_LOOK,
+            vel=rand_in_circle(rng, n, 0.6),
+            lifetime=rng.uniform(1.5, 2.5, n) * life,
+            start_alpha=200,
+            scale=rng.uniform(0.6, 0.9, n) * size,
+            mutator=smoke_mutator,
         ),
     )
 
 
 def make_trail(attached_sprite, maintain=60):
     # «След за объектом»: поддерживаем постоянное число частиц
-    emit = Emitter(
+    emit = ParticleEmitter(
         center_xy=(attached_sprite.center_x, attached_sprite.center_y),
-        emit_controller=EmitMaintainCount(maintain),
-        particle_factory=lambda e: FadeParticle(
-            filename_or_texture=random.choice(SPARK_TEX),
-            change_xy=arcade.math.rand_in_circle((0.0, 0.0), 1.6),
-            lifetime=random.uniform(0.35, 0.9),
-            start_alpha=220, end_alpha=0,
-            scale=random.uniform(0.25, 0.9),
+        mode="maintain", amount=PARTICLE_BUDGET.grant(maintain),
+        make=lambda rng, n: dict(
+            look=rng.choice(SPARK_LOOKS, n),
+            vel=rand_in_circle(rng, n, 1.6),
+            lifetime=rng.uniform(0.35, 0.9, n),
+            start_alpha=220,
+            scale=rng.uniform(0.25, 0.9, n),
         ),
     )
-    # Хитрость: каждое обновление будем прижимать центр к спрайту (см. ниже)
-    emit._attached = attached_sprite
+    emit.attached = attached_sprite  # EmitterManager сам двигает центр за спрайтом
     return emit
 
 
+class AudioMixer:
+    # Все звуки игры. Эффекты — из заранее декодированных буферов (AssetCache), музыка — потоком.
+    # play() только ставит эффект в очередь кадра: одинаковые за кадр сливаются в один
+    # (с наибольшей громкостью). update() раз в кадр запускает очередь с ограничением голосов:
+    # у звука свой лимит копий (вытесняется самая старая), а когда заняты все max_voices —
+    # вытесняется голос с приоритетом не выше нового, иначе новый звук не играет.
+    # silent — ничего не воспроизводим (headless: может не быть ни устройства, ни декодера mp3),
+    # но очередь и счётчики работают как обычно.
+    def __init__(self, max_voices=MAX_VOICES, silent=False):
+        self.max_voices = max_voices
+        self.silent = silent
+        self.pending = {}  # Номер звука -> громкость
+        self.voices = []  # (номер звука, приоритет, player) в порядке запуска
+        self.music = None  # (файл, громкость, player)
+        self.played = 0
+        self.coalesced = 0
+        self.stolen = 0
+        self.skipped = 0
+        self.music_starts = 0
+
+    def play(self, sound_id, volume=None):
+        if volume is None:
+            volume = EVENT_SOUNDS[sound_id][1]
+        if sound_id in self.pending:
+            self.coalesced += 1
+            volume = max(volume, self.pending[sound_id])
+        self.pending[sound_id] = volume
+
+    def update(self):
+        if self.silent:
+            self.played += len(self.pending)
+            self.pending.clear()
+            return
+        if self.music is not None and not self.music[2].playing:
+            path, volume, _ = self.music
+            self.music = None
+            self.play_music(path, volume)  # Трек кончился — запускаем заново
+        if not self.pending:
+            return
+        self.voices = [voice for voice in self.voices if voice[2].playing]
+        for sound_id, volume in self.pending.items():
+            cap, priority = SOUND_VOICES[sound_id]
+            same = [voice for voice in self.voices if voice[0] == sound_id]
+            if len(same) >= cap:
+                self._steal(same[0])
+            elif len(self.voices) >= self.max_voices:
+                victims = [voice for voice in self.voices if voice[1] <= priority]
+                if not victims:
+                    self.skipped += 1
+                    continue
+                self._steal(min(victims, key=lambda voice: voice[1]))  # Младший приоритет, из них самый старый
+            player = ASSETS.sound(EVENT_SOUNDS[sound_id][0]).play(volume=volume)
+            self.voices.append((sound_id, priority, player))
+            self.played += 1
+        self.pending.clear()
+
+    def _steal(self, voice):
+        self.voices.remove(voice)
+        arcade.stop_sound(voice[2])
+        self.stolen += 1
+
+    def play_music(self, path=MUSIC_TRACK, volume=0.5):
+        # Музыку не декодируем целиком, а читаем потоком. Потоковый источник играет
+        # только один раз, поэтому на каждый запуск он создаётся заново
+        if self.music is not None and self.music[0] == path:
+            if self.music[2] is not None:
+                self.music[2].volume = volume
+            self.music = (path, volume, self.music[2])
+            return
+        self.stop_music()
+        player = None if self.silent else arcade.load_sound(path, streaming=True).play(volume=volume)
+        self.music = (path, volume, player)
+        self.music_starts += 1
+
+    def stop_music(self):
+        if self.music is not None:
+            if self.music[2] is not None:
+                arcade.stop_sound(self.music[2])
+            self.music = None
+
+    def stats(self):
+        return {
+            "voices": sum(1 for voice in self.voices if voice[2].playing),
+            "played": self.played,
+            "coalesced": self.coalesced,
+            "stolen": self.stolen,
+            "skipped": self.skipped,
+            "music": self.music[0] if self.music else None,
+            "music_starts": self.music_starts,
+        }
+
+
+AUDIO = AudioMixer(silent=HEADLESS)
+
+
 class MenuView(arcade.View):
     def __init__(self):
         super().__init__()
         self.background_color = arcade.color.BLACK  # Фон для меню
-        self.emitters = []
+        self.emitters = EmitterManager()
+        PARTICLES.clear()
+        LEVELS.prefetch("testik1.tmx")  # Первый уровень готовим, пока игрок в меню
         self.timer = 0
-        self.sound = arcade.load_sound("ruskerdax_-_savage_ambush.mp3")
         BG_BLACK = (0, 0, 0)
         PURE_NEON = (57, 255, 20)
         DARK_NEON = (20, 100, 10)
@@ -165,21 +857,18 @@ class MenuView(arcade.View):
     def on_draw(self):
         self.clear()
         self.manager.draw()
-        for e in self.emitters:
-            e.draw()
+        self.emitters.draw()
 
     def on_update(self, dt):
+        PARTICLE_BUDGET.observe(PARTICLES.count, dt * 1000)
         self.timer += dt
         if self.timer > 0.2:
-            self.emitters.append(make_explosion(random.randint(50, 1870), random.randint(50, 1030), count=130))
-            self.emitters.append(make_explosion(random.randint(50, 1870), random.randint(50, 1030), count=130))
+            self.emitters.spawn(make_explosion(random.randint(50, 1870), random.randint(50, 1030), count=130))
+            self.emitters.spawn(make_explosion(random.randint(50, 1870), random.randint(50, 1030), count=130))
             self.timer = 0
-        emitters_copy = self.emitters.copy()  # Защищаемся от мутаций списка
-        for e in emitters_copy:
-            e.update(dt)
-        for e in emitters_copy:
-            if e.can_reap():  # Готов к уборке?
-                self.emitters.remove(e)
+        self.emitters.update(dt)  # Заодно убирает «умершие» эмиттеры
+        AUDIO.update()
+        LEVELS.pump()  # Первый уровень достраивается, пока игрок в меню
 
     def setup_widgets(self):
         # Здесь добавим ВСЕ виджеты — по порядку!
@@ -209,10 +898,10 @@ class MenuView(arcade.View):
         self.window.show_view(guide)
 
     def on_show_view(self):
-        self.backgound_player = self.sound.play(loop=True, volume=0.4)
+        AUDIO.play_music(MUSIC_TRACK, volume=0.4)
 
     def on_hide_view(self):
-        arcade.stop_sound(self.backgound_player)
+        AUDIO.stop_music()
 
     def on_mouse_press(self, x, y, button, modifiers):
         pass
@@ -253,6 +942,12 @@ class Guide(arcade.View):
                         text_color=arcade.color.NEON_GREEN,
                         align="center")
         self.box_layout.add(label)
+        label = UILabel(text="F3 показывает замеры кадра, F4 сохраняет их в profile_trace.json/.csv",
+                        font_name='Bahnschrift',
+                        font_size=20,
+                        text_color=arcade.color.NEON_GREEN,
+                        align="center")
+        self.box_layout.add(label)
         label = UILabel(text="ЧТОБЫ ВЕРНУТЬСЯ В МЕНЮ НАЖМИТЕ ПРОБЕЛ",
                         font_name='Bahnschrift',
                         font_size=30,
@@ -270,20 +965,1594 @@ class Guide(arcade.View):
         pass
 
 
-class Bullet(arcade.Sprite):
-    def __init__(self, start_x, start_y, target_x, target_y,
-                 speed=800, damage=50, owner="player"):
+class SpritePool:
+    # Пул переиспользуемых спрайтов: acquire() выдаёт готовый объект, release() возвращает его обратно
+    def __init__(self, factory, capacity):
+        self.factory = factory
+        self.capacity = capacity
+        self.free = []
+        self.created = 0
+        self.in_use = 0
+        self.high_water = 0
+        self.rejected = 0
+
+    def _create(self):
+        sprite = self.factory()
+        sprite.pool = self
+        sprite.in_pool = True
+        self.created += 1
+        return sprite
+
+    def prewarm(self, count):
+        # Создаём объекты заранее, чтобы в бою не было аллокаций
+        while self.created < min(count, self.capacity):
+            self.free.append(self._create())
+
+    def acquire(self):
+        if self.free:
+            sprite = self.free.pop()
+        elif self.created < self.capacity:
+            sprite = self._create()
+        else:
+            self.rejected += 1  # Пул исчерпан — снаряд просто не появится
+            return None
+        sprite.in_pool = False
+        self.in_use += 1
+        self.high_water = max(self.high_water, self.in_use)
+        return sprite
+
+    def release(self, sprite):
+        if sprite.in_pool:
+            return  # Уже вернули (например, пуля задела сразу две цели)
+        sprite.remove_from_sprite_lists()
+        sprite.in_pool = True
+        self.in_use -= 1
+        self.free.append(sprite)
+
+    def stats(self):
+        return {
+            "capacity": self.capacity,
+            "created": self.created,
+            "in_use": self.in_use,
+            "high_water": self.high_water,
+            "rejected": self.rejected,
+        }
+
+
+class PooledSprite(arcade.Sprite):
+    # Спрайт, который вместо удаления возвращается в свой пул
+    def __init__(self):
+        super().__init__()
+        self.pool = None
+        self.in_pool = False
+
+    def release(self):
+        if self.pool is None:
+            self.remove_from_sprite_lists()
+        else:
+            self.pool.release(self)
+
+
+class CollisionGrid:
+    # Слой "collision" запечён в булеву сетку тайлов: точка и прямоугольник
+    # проверяются за O(1), отрезок — проходом по клеткам (DDA)
+
+    def __init__(self, cols, rows, tile_w, tile_h):
+        self.cols = cols
+        self.rows = rows
+        self.tile_w = tile_w
+        self.tile_h = tile_h
+        self.solid = np.zeros((rows, cols), dtype=bool)
+
+    @classmethod
+    def from_sprite_list(cls, sprite_list, cols, rows, tile_w, tile_h):
+        grid = cls(cols, rows, tile_w, tile_h)
+        for sprite in sprite_list:
+            # Помечаем все клетки, которые перекрывает тайл
+            c0, r0 = grid.cell_of(sprite.left + 1, sprite.bottom + 1)
+            c1, r1 = grid.cell_of(sprite.right - 1, sprite.top - 1)
+            grid.solid[max(r0, 0):r1 + 1, max(c0, 0):c1 + 1] = True
+        return grid
+
+    def cell_of(self, x, y):
+        return int(x // self.tile_w), int(y // self.tile_h)
+
+    def is_solid_cell(self, col, row):
+        # За краем карты считаем стену — так ничто не улетит «в пустоту»
+        if col < 0 or row < 0 or col >= self.cols or row >= self.rows:
+            return True
+        return bool(self.solid[row, col])
+
+    def solid_at_points(self, xs, ys):
+        # Векторная проверка сразу для массива точек
+        cols = np.floor_divide(xs, self.tile_w).astype(np.int64)
+        rows = np.floor_divide(ys, self.tile_h).astype(np.int64)
+        inside = (cols >= 0) & (rows >= 0) & (cols < self.cols) & (rows < self.rows)
+        result = np.ones(len(cols), dtype=bool)
+        result[inside] = self.solid[rows[inside], cols[inside]]
+        return result
+
+    def overlaps_rect(self, left, bottom, right, top):
+        c0, r0 = self.cell_of(left, bottom)
+        c1, r1 = self.cell_of(right, top)
+        if c0 < 0 or r0 < 0 or c1 >= self.cols or r1 >= self.rows:
+            return True
+        return bool(self.solid[r0:r1 + 1, c0:c1 + 1].any())
+
+    def segment_hit(self, x0, y0, x1, y1):
+        # Проход по клеткам вдоль отрезка (Amanatides–Woo).
+        # Возвращает долю пути t до первой твёрдой клетки или None.
+        col, row = self.cell_of(x0, y0)
+        end_col, end_row = self.cell_of(x1, y1)
+        if self.is_solid_cell(col, row):
+            return 0.0
+        dx = x1 - x0
+        dy = y1 - y0
+        step_c = 1 if dx > 0 else -1
+        step_r = 1 if dy > 0 else -1
+        if dx != 0:
+            next_x = (col + (step_c > 0)) * self.tile_w
+            t_max_x = (next_x - x0) / dx
+            t_delta_x = self.tile_w / abs(dx)
+        else:
+            t_max_x = t_delta_x = math.inf
+        if dy != 0:
+            next_y = (row + (step_r > 0)) * self.tile_h
+            t_max_y = (next_y - y0) / dy
+            t_delta_y = self.tile_h / abs(dy)
+        else:
+            t_max_y = t_delta_y = math.inf
+
+        while col != end_col or row != end_row:
+            if t_max_x < t_max_y:
+                t = t_max_x
+                col += step_c
+                t_max_x += t_delta_x
+            else:
+                t = t_max_y
+                row += step_r
+                t_max_y += t_delta_y
+            if t > 1.0:
+                break
+            if self.is_solid_cell(col, row):
+                return t
+        return None
+
+
+class CompiledLevel:
+    # Уровень из кэша: то же, что setup() берёт у arcade.TileMap (sprite_lists и размеры),
+    # плюс готовая сетка столкновений и таблицы спавна (центры тайлов по слоям)
+    def __init__(self, meta, sprite_lists, spawns, grid):
+        self.width = meta["width"]
+        self.height = meta["height"]
+        self.tile_width = meta["tile_width"]
+        self.tile_height = meta["tile_height"]
+        self.sprite_lists = sprite_lists
+        self.spawns = spawns
+        self.grid = grid
+
+
+class PreparedLevel:
+    # Уровень из кэша до создания спрайтов: meta, координаты и gid'ы тайлов по слоям,
+    # вырезанные из листов картинки тайлов, таблицы спавна и сетка столкновений.
+    # Собирается без arcade, поэтому годится для фонового потока
+    def __init__(self, folder, meta, compiled, tiles, images, spawns, grid):
+        self.folder = folder
+        self.meta = meta
+        self.compiled = compiled
+        self.tiles = tiles  # Имя слоя -> (gid'ы, x, y)
+        self.images = images  # gid -> (ключ текстуры, картинка PIL)
+        self.spawns = spawns
+        self.grid = grid
+
+
+class LevelCompiler:
+    # «Компилятор» карт: testikN.tmx -> level_cache/testikN/.
+    # Слои тайлов лежат как .npy с gid'ами (читаются через mmap), collision — упакованными битами,
+    # для слоёв из SPAWN_LAYERS — таблицы центров тайлов, в meta.json — размеры, откуда брать
+    # текстуру каждого gid и хэш исходников (.tmx и его .tsx). Хэш не совпал — компилируем заново,
+    # так что загрузка уровня — это mmap и создание спрайтов, без XML, base64 и zlib.
+    def __init__(self, root=LEVEL_CACHE_DIR):
+        self.root = root
+        self.compiled = 0
+        self.loaded = 0
+        self.textures = {}  # (лист, x, y, ширина, высота) -> arcade.Texture; только главный поток
+
+    def folder(self, map_name):
+        return os.path.join(self.root, os.path.splitext(os.path.basename(map_name))[0])
+
+    @staticmethod
+    def source_hash(map_name):
+        digest = hashlib.sha1()
+        with open(map_name, "rb") as f:
+            text = f.read()
+        digest.update(text)
+        base = os.path.dirname(map_name)
+        for source in re.findall(rb'<tileset[^>]*source="([^"]+)"', text):
+            with open(os.path.join(base, source.decode()), "rb") as f:
+                digest.update(f.read())
+        return digest.hexdigest()
+
+    def load(self, map_name, lazy=False):
+        return self.instantiate(self.prepare(map_name), lazy)
+
+    def prepare(self, map_name):
+        # Хэш, компиляция при надобности, чтение .npy и декодирование листов тайлов (PIL) —
+        # без arcade и без счётчиков
+        folder = self.folder(map_name)
+        digest = self.source_hash(map_name)
+        meta = None
+        try:
+            with open(os.path.join(folder, "meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            pass
+        compiled = meta is None or meta.get("format") != LEVEL_FORMAT or meta.get("source_hash") != digest
+        if compiled:
+            meta = self.compile(map_name, folder, digest)
+
+        cols, rows = meta["width"], meta["height"]
+        tile_w = meta["tile_width"] * TILE_SCALING
+        tile_h = meta["tile_height"] * TILE_SCALING
+        tiles, spawns = {}, {}
+        for layer in meta["layers"]:
+            name = layer["name"]
+            if name in SPAWN_LAYERS:
+                spawns[name] = np.load(os.path.join(folder, f"spawn_{name}.npy"), mmap_mode="r")
+            if name in ACTOR_LAYERS or name == "collision":
+                continue  # Заглушки не нужны: актёров setup() ставит по таблице спавна, стены — сетка
+            gids = np.load(os.path.join(folder, f"{name}.npy"), mmap_mode="r")
+            r, c = np.nonzero(gids)
+            tiles[name] = (gids[r, c].tolist(), ((c + 0.5) * tile_w).tolist(), ((rows - r - 0.5) * tile_h).tolist())
+
+        sheets, images = {}, {}
+        for gid, (path, x, y, w, h) in meta["textures"].items():
+            path = os.path.normpath(os.path.join(folder, path))
+            sheet = sheets.get(path)
+            if sheet is None:
+                sheet = sheets[path] = Image.open(path).convert("RGBA")
+            images[int(gid)] = ((path, x, y, w, h), sheet.crop((x, y, x + w, y + h)))
+
+        grid = CollisionGrid(cols, rows, tile_w, tile_h)
+        if any(layer["name"] == "collision" for layer in meta["layers"]):
+            bits = np.load(os.path.join(folder, "collision_bits.npy"), mmap_mode="r")
+            grid.solid = np.unpackbits(bits, count=rows * cols).reshape(rows, cols).astype(bool)
+        return PreparedLevel(folder, meta, compiled, tiles, images, spawns, grid)
+
+    def compile(self, map_name, folder, digest):
+        tiled_map = pytiled_parser.parse_map(Path(map_name))
+        cols, rows = tiled_map.map_size.width, tiled_map.map_size.height
+        tile_w, tile_h = tiled_map.tile_size.width, tiled_map.tile_size.height
+        os.makedirs(folder, exist_ok=True)
+        layers, textures = [], {}
+        for layer in tiled_map.layers:
+            if not isinstance(layer, pytiled_parser.TileLayer):
+                continue
+            gids = np.array(layer.data, dtype=np.uint32).reshape(rows, cols)
+            if (gids & TILE_FLIP_FLAGS).any():
+                raise ValueError(f"{map_name}: отражённые тайлы в слое '{layer.name}' не поддерживаются")
+            if layer.name != "collision":  # Стены столкновений — только в битовую сетку ниже
+                np.save(os.path.join(folder, f"{layer.name}.npy"), gids)
+                for gid in np.unique(gids[gids > 0]).tolist():
+                    textures[str(gid)] = self._tile_source(tiled_map, gid, folder)
+            layers.append({
+                "name": layer.name,
+                "visible": layer.visible,
+                "opacity": layer.opacity,
+                "tint": list(layer.tint_color) if layer.tint_color else None,
+            })
+            if layer.name == "collision":
+                # Строки в сетке идут снизу вверх, как координата y
+                np.save(os.path.join(folder, "collision_bits.npy"), np.packbits(gids[::-1] > 0))
+            if layer.name in SPAWN_LAYERS:
+                r, c = np.nonzero(gids)
+                centers = np.column_stack(((c + 0.5) * tile_w, (rows - r - 0.5) * tile_h)) * TILE_SCALING
+                np.save(os.path.join(folder, f"spawn_{layer.name}.npy"), centers.astype(np.float32))
+        meta = {
+            "format": LEVEL_FORMAT,
+            "source": os.path.basename(map_name),
+            "source_hash": digest,
+            "width": cols,
+            "height": rows,
+            "tile_width": tile_w,
+            "tile_height": tile_h,
+            "layers": layers,
+            "textures": textures,
+        }
+        # meta.json пишем последним и атомарно: без него кэш считается невалидным
+        tmp = os.path.join(folder, "meta.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, os.path.join(folder, "meta.json"))
+        return meta
+
+    @staticmethod
+    def _tile_source(tiled_map, gid, folder):
+        # Как arcade: ищем тайлсет с наибольшим firstgid <= gid и вырезаем тайл из листа.
+        # Путь к листу храним относительно папки кэша — не зависит от текущего каталога
+        first = max(key for key in tiled_map.tilesets if key <= gid)
+        tileset = tiled_map.tilesets[first]
+        if tileset.image is None:
+            raise ValueError(f"Тайлсет '{tileset.name}' без общего листа не поддерживается")
+        tile_id = gid - first
+        margin, spacing = tileset.margin or 0, tileset.spacing or 0
+        x = margin + (tile_id % tileset.columns) * (tileset.tile_width + spacing)
+        y = margin + (tile_id // tileset.columns) * (tileset.tile_height + spacing)
+        return [os.path.relpath(tileset.image, folder), x, y, tileset.tile_width, tileset.tile_height]
+
+    def instantiate(self, prepared, lazy=False):
+        build = self.build(prepared, lazy)
+        while True:
+            try:
+                next(build)
+            except StopIteration as done:
+                return done.value
+
+    def build(self, prepared, lazy=False):
+        # Текстуры и спрайты: только в главном потоке. Генератор — отдаёт управление
+        # каждые LEVEL_BUILD_BATCH спрайтов, чтобы LevelLoader.pump() мог строить уровень
+        # по кусочку за кадр; готовый CompiledLevel — значение StopIteration
+        meta = prepared.meta
+        textures = {}
+        for gid, (key, image) in prepared.images.items():
+            texture = self.textures.get(key)
+            if texture is None:
+                texture = self.textures[key] = arcade.Texture(image)
+                yield
+            textures[gid] = texture
+
+        sprite_lists = {}
+        for layer in meta["layers"]:
+            name = layer["name"]
+            if name == "collision":
+                continue  # Уже в prepared.grid, спрайты стен столкновений никому не нужны
+            sprite_list = arcade.SpriteList(lazy=lazy)
+            sprite_list.visible = layer["visible"]
+            sprite_lists[name] = sprite_list
+            if name not in prepared.tiles:
+                continue
+            color = arcade.types.Color.from_iterable(layer["tint"]) if layer["tint"] else None
+            for n, (gid, x, y) in enumerate(zip(*prepared.tiles[name]), 1):
+                sprite = arcade.Sprite(textures[gid], scale=TILE_SCALING, center_x=x, center_y=y)
+                if color:
+                    sprite.color = color
+                if layer["opacity"]:
+                    sprite.alpha = int(layer["opacity"] * 255)
+                sprite_list.append(sprite)
+                if n % LEVEL_BUILD_BATCH == 0:
+                    yield
+
+        self.compiled += prepared.compiled
+        self.loaded += 1
+        return CompiledLevel(meta, sprite_lists, prepared.spawns, prepared.grid)
+
+    def stats(self):
+        return {"compiled": self.compiled, "loaded": self.loaded}
+
+
+LEVEL_CACHE = LevelCompiler()
+
+
+class LevelLoader:
+    # Карта следующего уровня готовится, пока играется текущий. Фоновый поток делает всё,
+    # что не трогает arcade: хэш, компиляцию, .npy и декодирование листов тайлов (PIL).
+    # Текстуры и спрайты создаёт главный поток: pump() раз в кадр достраивает их не дольше
+    # budget_ms, так что к выходу с уровня take() обычно просто забирает готовые спрайт-листы.
+    def __init__(self, budget_ms=LEVEL_BUILD_BUDGET_MS):
+        self.budget_ms = budget_ms
+        self.pending = {}  # Имя карты -> словарь: поток, результат потока, стройка, готовый уровень
+
+    def prefetch(self, map_name):
+        if map_name in self.pending or not os.path.exists(map_name):
+            return  # Уже грузится или такого уровня нет (ошибку покажет take)
+        result = {}
+        thread = threading.Thread(target=self._load, args=(map_name, result), daemon=True)
+        self.pending[map_name] = {"thread": thread, "result": result, "build": None, "level": None,
+                                  "build_ms": 0.0}
+        thread.start()
+
+    @staticmethod
+    def _load(map_name, result):
+        start = time.perf_counter()
+        try:
+            result["prepared"] = LEVEL_CACHE.prepare(map_name)
+        except Exception as error:  # Пробросим в главный поток при take()
+            result["error"] = error
+        result["load_ms"] = (time.perf_counter() - start) * 1000
+
+    @staticmethod
+    def _advance(entry, deadline=None):
+        # Строим, пока не выйдет время (deadline=None — до конца)
+        if entry["build"] is None:
+            entry["build"] = LEVEL_CACHE.build(entry["result"]["prepared"])
+        start = time.perf_counter()
+        try:
+            while deadline is None or time.perf_counter() < deadline:
+                next(entry["build"])
+        except StopIteration as done:
+            entry["level"] = done.value
+        entry["build_ms"] += (time.perf_counter() - start) * 1000
+
+    def pump(self):
+        # Раз в кадр, в главном потоке
+        deadline = time.perf_counter() + self.budget_ms / 1000
+        for entry in self.pending.values():
+            if entry["level"] is not None or entry["thread"].is_alive() or "error" in entry["result"]:
+                continue
+            self._advance(entry, deadline)
+            if time.perf_counter() >= deadline:
+                return
+
+    def take(self, map_name):
+        # Готовая карта забирается целиком (каждую можно взять один раз).
+        # Если фоновая подготовка или стройка не успели — доделываем сразу; если их не было — грузим сразу.
+        entry = self.pending.pop(map_name, None)
+        start = time.perf_counter()
+        if entry is None:
+            level = LEVEL_CACHE.load(map_name)
+            load_ms = (time.perf_counter() - start) * 1000
+            return level, {"map": map_name, "preloaded": False, "load_ms": round(load_ms, 3),
+                           "wait_ms": round(load_ms, 3)}
+        entry["thread"].join()
+        if "error" in entry["result"]:
+            raise entry["result"]["error"]
+        if entry["level"] is None:
+            self._advance(entry)
+        wait_ms = (time.perf_counter() - start) * 1000
+        return entry["level"], {"map": map_name, "preloaded": True,
+                                "load_ms": round(entry["result"]["load_ms"], 3),
+                                "build_ms": round(entry["build_ms"], 3), "wait_ms": round(wait_ms, 3)}
+
+
+LEVELS = LevelLoader()
+
+
+CHUNK_VS = """
+#version 330
+
+uniform WindowBlock {
+    mat4 projection;
+    mat4 view;
+} window;
+
+uniform vec4 rect;  // left, bottom, width, height чанка в мире
+
+in vec2 in_vert;
+
+out vec2 v_uv;
+
+void main() {
+    v_uv = in_vert;
+    gl_Position = window.projection * window.view * vec4(rect.xy + in_vert * rect.zw, 0.0, 1.0);
+}
+"""
+
+CHUNK_FS = """
+#version 330
+
+uniform sampler2D chunk;
+
+in vec2 v_uv;
+
+out vec4 f_color;
+
+void main() {
+    f_color = texture(chunk, v_uv);
+}
+"""
+
+
+class StaticChunks:
+    # Статичные слои карты (стены, сундуки, выход, двери, бочки) запечены в текстуры
+    # по CHUNK_TILES x CHUNK_TILES тайлов. В кадре рисуем только чанки, которые видит камера,
+    # — по одному квадрату на чанк. Изменился тайл (открылась дверь, разбили бочку) —
+    # перезапекается только его чанк, и то лишь когда он снова попадёт в кадр.
+    def __init__(self, chunk_tiles=CHUNK_TILES):
+        self.chunk_tiles = chunk_tiles
+        self.layers = []
+        self.textures = {}  # (столбец, строка) чанка -> (текстура, framebuffer)
+        self.dirty = set()
+        self.visible = []
+        self.chunk_w = self.chunk_h = 0
+        self.cols = self.rows = 0
+        self.program = None
+        self.geometry = None
+        self.bakes = 0
+
+    def reset(self, layers, cols, rows, tile_w, tile_h):
+        # Новый уровень: текстуры переиспользуем, если размер чанка тот же
+        chunk_w, chunk_h = int(self.chunk_tiles * tile_w), int(self.chunk_tiles * tile_h)
+        if (chunk_w, chunk_h) != (self.chunk_w, self.chunk_h):
+            self.textures = {}
+        self.layers = layers
+        self.chunk_w, self.chunk_h = chunk_w, chunk_h
+        self.cols = math.ceil(cols / self.chunk_tiles)
+        self.rows = math.ceil(rows / self.chunk_tiles)
+        self.dirty = {(c, r) for c in range(self.cols) for r in range(self.rows)}
+
+    def invalidate(self, sprite):
+        # Спрайт мог лежать на границе — помечаем все чанки под его прямоугольником
+        c0, r0 = int(sprite.left // self.chunk_w), int(sprite.bottom // self.chunk_h)
+        c1, r1 = int(sprite.right // self.chunk_w), int(sprite.top // self.chunk_h)
+        for c in range(max(c0, 0), min(c1, self.cols - 1) + 1):
+            for r in range(max(r0, 0), min(r1, self.rows - 1) + 1):
+                self.dirty.add((c, r))
+
+    def cull(self, camera):
+        # Какие чанки пересекают прямоугольник, видимый камерой
+        half_w = camera.viewport_width / camera.zoom / 2
+        half_h = camera.viewport_height / camera.zoom / 2
+        x, y = camera.position
+        c0, c1 = int((x - half_w) // self.chunk_w), int((x + half_w) // self.chunk_w)
+        r0, r1 = int((y - half_h) // self.chunk_h), int((y + half_h) // self.chunk_h)
+        self.visible = [(c, r) for c in range(max(c0, 0), min(c1, self.cols - 1) + 1)
+                        for r in range(max(r0, 0), min(r1, self.rows - 1) + 1)]
+        return self.visible
+
+    def bake_visible(self, camera):
+        # Вызывать до camera.use(): запекание переключает framebuffer и камеру
+        for chunk in self.cull(camera):
+            if chunk in self.dirty:
+                self.bake(chunk)
+
+    def bake(self, chunk):
+        ctx = arcade.get_window().ctx
+        if chunk not in self.textures:
+            texture = ctx.texture((self.chunk_w, self.chunk_h), components=4,
+                                  wrap_x=ctx.CLAMP_TO_EDGE, wrap_y=ctx.CLAMP_TO_EDGE)
+            self.textures[chunk] = (texture, ctx.framebuffer(color_attachments=[texture]))
+        texture, fbo = self.textures[chunk]
+        c, r = chunk
+        camera = arcade.camera.Camera2D(
+            viewport=arcade.LBWH(0, 0, self.chunk_w, self.chunk_h),
+            position=((c + 0.5) * self.chunk_w, (r + 0.5) * self.chunk_h),
+            render_target=fbo,
+        )
+        with fbo.activate():
+            fbo.clear()
+            camera.use()
+            for layer in self.layers:
+                # Цвет сразу умножаем на альфу: тогда чанк накладывается без тёмных ореолов
+                layer.draw(blend_function=(ctx.SRC_ALPHA, ctx.ONE_MINUS_SRC_ALPHA,
+                                           ctx.ONE, ctx.ONE_MINUS_SRC_ALPHA))
+        self.dirty.discard(chunk)
+        self.bakes += 1
+
+    def draw(self):
+        # Рисуем чанки, отобранные в bake_visible (камера мира уже включена).
+        # Возвращает число вызовов отрисовки — по одному на чанк
+        ctx = arcade.get_window().ctx
+        if self.program is None:
+            self.program = ctx.program(vertex_shader=CHUNK_VS, fragment_shader=CHUNK_FS)
+            quad = np.array([0, 0, 1, 0, 0, 1, 1, 1], dtype=np.float32)
+            self.geometry = ctx.geometry([BufferDescription(ctx.buffer(data=quad.tobytes()), "2f", ["in_vert"])])
+        ctx.enable(ctx.BLEND)
+        ctx.blend_func = ctx.ONE, ctx.ONE_MINUS_SRC_ALPHA
+        for c, r in self.visible:
+            self.textures[(c, r)][0].use(0)
+            self.program["rect"] = (c * self.chunk_w, r * self.chunk_h, self.chunk_w, self.chunk_h)
+            self.geometry.render(self.program, mode=ctx.TRIANGLE_STRIP)
+        ctx.blend_func = ctx.BLEND_DEFAULT
+        return len(self.visible)
+
+    def stats(self):
+        return {
+            "chunks": self.cols * self.rows,
+            "visible": len(self.visible),
+            "dirty": len(self.dirty),
+            "bakes": self.bakes,
+        }
+
+
+class LineOfSight:
+    # Видимость по сетке тайлов: луч от центра клетки наблюдателя до центра клетки игрока.
+    # Спрашивает AIScheduler; результат кэшируется по паре клеток,
+    # пока игрок не перейдёт в другую клетку.
+    def __init__(self, grid):
+        self.grid = grid
+        self.cache = {}
+        self.player_cell = None
+        self.queries = 0
+        self.cache_hits = 0
+        self.rays = 0
+
+    def begin_frame(self, player):
+        cell = self.grid.cell_of(player.center_x, player.center_y)
+        if cell != self.player_cell:
+            self.cache.clear()  # Со старой клетки игрока ключи больше не понадобятся
+            self.player_cell = cell
+
+    def check_cell(self, cell):
+        self.queries += 1
+        key = (cell, self.player_cell)
+        visible = self.cache.get(key)
+        if visible is None:
+            self.rays += 1
+            grid = self.grid
+            visible = grid.segment_hit(
+                (cell[0] + 0.5) * grid.tile_w, (cell[1] + 0.5) * grid.tile_h,
+                (self.player_cell[0] + 0.5) * grid.tile_w, (self.player_cell[1] + 0.5) * grid.tile_h,
+            ) is None
+            self.cache[key] = visible
+        else:
+            self.cache_hits += 1
+        return visible
+
+    def stats(self):
+        return {
+            "queries": self.queries,
+            "cache_hits": self.cache_hits,
+            "rays": self.rays,
+            "cached": len(self.cache),
+        }
+
+
+class AIScheduler:
+    # Дорогая работа ИИ (видимость, перезахват цели, запрос пути) — одна очередь на всех.
+    # Актёр (слот в ActorStore), которому пора «подумать», встаёт в конец; за шаг очередь
+    # разбирается с головы, пока не кончится бюджет (budget_ms, но не больше max_jobs задач) —
+    # остальные ждут следующего шага. Всплеск запросов так размазывается по кадрам.
+    def __init__(self, store, budget_ms=AI_BUDGET_MS, max_jobs=AI_JOBS_PER_STEP):
+        self.store = store
+        self.budget_ms = budget_ms  # None — только лимит по числу задач (для воспроизводимости)
+        self.max_jobs = max_jobs
+        self.queue = deque()
+        self.vision = None
+        self.flow = None
+        self.step_index = 0
+        self.jobs = 0
+        self.latency_total = 0
+        self.latency_max = 0
+        self.last_ms = 0.0
+
+    def reset(self, vision, flow):
+        # Новый уровень: старая очередь ссылается на актёров прошлой карты
+        for slot in self.queue:
+            self.store.ai_queued[slot] = False
+        self.queue.clear()
+        self.vision = vision
+        self.flow = flow
+
+    def request(self, slot):
+        store = self.store
+        if store.ai_queued[slot]:
+            return
+        store.ai_queued[slot] = True
+        store.ai_since[slot] = self.step_index
+        self.queue.append(slot)
+
+    def run(self, player):
+        store = self.store
+        start = time.perf_counter()
+        done = 0
+        while self.queue and done < self.max_jobs:
+            if self.budget_ms is not None and done and (time.perf_counter() - start) * 1000 >= self.budget_ms:
+                break
+            slot = self.queue.popleft()
+            store.ai_queued[slot] = False
+            if not store.alive[slot]:
+                continue  # Убит, пока ждал
+            latency = self.step_index - int(store.ai_since[slot])
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+            self.think(slot, player)
+            done += 1
+        self.jobs += done
+        self.last_ms = (time.perf_counter() - start) * 1000
+        self.step_index += 1  # Задержка — сколько шагов актёр простоял в очереди
+
+    def think(self, slot, player):
+        store = self.store
+        x, y = store.pos[slot].tolist()
+        dx = player.center_x - x
+        dy = player.center_y - y
+        sight = store.sight_range[slot]
+        if dx * dx + dy * dy < sight * sight:
+            # Стены между актёром и игроком — по сетке тайлов (с кэшем по паре клеток)
+            can_see = self.vision.check_cell(self.vision.grid.cell_of(x, y))
+        else:
+            can_see = False
+        store.can_see[slot] = can_see
+        if can_see:
+            store.alerted[slot] = True
+        elif store.alerted[slot] and store.chases[slot]:
+            # Игрок пропал из виду — следующая клетка по полю путей
+            target = self.flow.next_step(x, y)
+            store.has_target[slot] = target is not None
+            if target is not None:
+                store.flow_target[slot] = target
+
+    def stats(self):
+        return {
+            "jobs": self.jobs,
+            "backlog": len(self.queue),
+            "avg_latency_steps": round(self.latency_total / self.jobs, 2) if self.jobs else 0.0,
+            "max_latency_steps": self.latency_max,
+            "last_ms": round(self.last_ms, 3),
+        }
+
+
+class ActivityZones:
+    # Кто из актёров живёт в этом шаге. Слоты ActorStore разложены по крупной сетке (ZONE_CELL),
+    # и каждый шаг просматриваются только клетки вокруг игрока: ближе ZONE_ACTIVE — обновляем
+    # каждый шаг, ближе ZONE_NEAR — раз в ZONE_NEAR_EVERY шагов с накопленным dt,
+    # остальные спят и ничего не стоят, пока игрок не подойдёт.
+    def __init__(self, store, cell_size=ZONE_CELL):
+        self.store = store
+        self.cell_size = cell_size
+        self.cells = {}  # (столбец, строка) -> слоты актёров в клетке
+        self.step_index = 0
+        self.active = 0
+        self.reduced = 0
+
+    def _cell(self, slot):
+        x, y = self.store.pos[slot].tolist()
+        return int(x // self.cell_size), int(y // self.cell_size)
+
+    def rebuild(self):
+        store = self.store
+        self.cells.clear()
+        for n, slot in enumerate(np.flatnonzero(store.alive).tolist()):
+            cell = self._cell(slot)
+            store.zone_cell[slot] = cell
+            store.zone_dt[slot] = 0.0
+            store.zone_phase[slot] = n % ZONE_NEAR_EVERY  # Разносим средних по разным шагам
+            self.cells.setdefault(cell, []).append(slot)
+
+    def relocate(self, slots):
+        # После движения: переложить тех, кто перешёл в другую клетку
+        store = self.store
+        for slot in slots[store.alive[slots]].tolist():
+            cell = self._cell(slot)
+            old = tuple(store.zone_cell[slot].tolist())
+            if cell != old:
+                self.cells[old].remove(slot)
+                self.cells.setdefault(cell, []).append(slot)
+                store.zone_cell[slot] = cell
+
+    def update(self, player, dt):
+        # Возвращает слоты, которые обновляются в этом шаге, и dt для каждого
+        store = self.store
+        self.step_index += 1
+        px, py = player.center_x, player.center_y
+        reach = math.ceil(ZONE_NEAR / self.cell_size)
+        pc, pr = int(px // self.cell_size), int(py // self.cell_size)
+        nearby = []
+        for row in range(pr - reach, pr + reach + 1):
+            for col in range(pc - reach, pc + reach + 1):
+                bucket = self.cells.get((col, row))
+                if not bucket:
+                    continue
+                if not store.alive[bucket].all():  # Убитых забываем
+                    bucket[:] = [slot for slot in bucket if store.alive[slot]]
+                nearby += bucket
+        nearby = np.array(nearby, dtype=np.int64)
+        delta = store.pos[nearby] - (px, py)
+        distance_sq = (delta * delta).sum(axis=1)
+        active = distance_sq < ZONE_ACTIVE * ZONE_ACTIVE
+        near = ~active & (distance_sq < ZONE_NEAR * ZONE_NEAR)
+        store.zone_dt[nearby[near]] += dt
+        due = near & ((self.step_index % ZONE_NEAR_EVERY + store.zone_phase[nearby]) % ZONE_NEAR_EVERY == 0)
+        awake = active | due
+        slots = nearby[awake]
+        dts = store.zone_dt[slots] + np.where(active[awake], dt, 0.0)
+        store.zone_dt[slots] = 0.0
+        self.active = len(slots)
+        self.reduced = int((dts > dt).sum())
+        return slots, dts
+
+    def stats(self):
+        return {
+            "total": self.store.count,
+            "updated": self.active,
+            "reduced": self.reduced,
+            "sleeping": self.store.count - self.active,
+        }
+
+
+class FlowField:
+    # Одно поле путей к игроку на всех преследователей: BFS от клетки игрока
+    # пересчитывается только когда игрок переходит в другую клетку, а каждый враг
+    # просто читает направление из своей клетки.
+    # BFS векторный (волна за волной массивами) и идёт не больше waves_per_step волн
+    # за шаг: на большой карте новое поле досчитывается за несколько шагов, а враги
+    # пока ходят по старому.
+    # Проходимость — та же сетка стен и закрытых дверей, в которую упирается WorldPhysics:
+    # открылась дверь — поле пересчитывается, даже если игрок стоит на месте.
+    def __init__(self, physics, max_steps=FLOW_MAX_STEPS, waves_per_step=FLOW_WAVES_PER_STEP):
+        grid = physics.grid
+        self.grid = grid
+        self.physics = physics
+        self.max_steps = max_steps
+        self.waves_per_step = waves_per_step
+        # Сетка с рамкой из стен в одну клетку: соседи — просто смещения плоского индекса
+        self.width = grid.cols + 2
+        self.free = None
+        self.revision = None  # Версия сетки WorldPhysics, по которой построено free
+        self.offsets = np.array([1, -1, self.width, -self.width])
+        self.dist = np.full((grid.rows, grid.cols), -1, dtype=np.int32)
+        self.step_c = np.zeros((grid.rows, grid.cols), dtype=np.int8)
+        self.step_r = np.zeros((grid.rows, grid.cols), dtype=np.int8)
+        self.target_cell = None
+        self.building = None  # Клетка, к которой сейчас досчитывается новое поле
+        self.pending = None
+        self.frontier = None
+        self.wave = 0
+        self.rebuilds = 0
+        self.rebuild_time = 0.0
+        self.max_step_ms = 0.0
+
+    def update(self, target_x, target_y):
+        # True — в этом шаге готово новое поле
+        if self.revision != self.physics.revision:
+            # Рамка у сетки физики такая же, в одну клетку
+            self.free = ~self.physics.blocked.ravel()
+            self.revision = self.physics.revision
+            self.target_cell = None  # Старое поле ещё водит врагов, пока не досчитано новое
+            self.building = None
+        cell = self.grid.cell_of(target_x, target_y)
+        if self.building is None:
+            if cell == self.target_cell:
+                return False
+            self._start(cell)  # Игрок снова сменит клетку, пока досчитываем, — догоним следующим
+        start = time.perf_counter()
+        done = self._advance(self.waves_per_step)
+        elapsed = time.perf_counter() - start
+        self.rebuild_time += elapsed
+        self.max_step_ms = max(self.max_step_ms, elapsed * 1000)
+        return done
+
+    def _start(self, cell):
+        self.building = cell
+        self.wave = 0
+        self.pending = np.full(self.free.size, -1, dtype=np.int32)
+        col, row = cell
+        index = (row + 1) * self.width + col + 1
+        if 0 <= col < self.grid.cols and 0 <= row < self.grid.rows and self.free[index]:
+            self.pending[index] = 0
+            self.frontier = np.array([index])
+        else:
+            self.frontier = np.empty(0, dtype=np.int64)
+
+    def _advance(self, waves):
+        pending = self.pending
+        frontier = self.frontier
+        while frontier.size and self.wave < self.max_steps and waves:
+            self.wave += 1
+            waves -= 1
+            near = (frontier[:, None] + self.offsets).ravel()
+            pending[near[self.free[near] & (pending[near] < 0)]] = self.wave
+            frontier = np.flatnonzero(pending == self.wave)  # Заодно без повторов
+        self.frontier = frontier
+        if frontier.size and self.wave < self.max_steps:
+            return False
+        self.dist = pending.reshape(-1, self.width)[1:-1, 1:-1].copy()
+        self._build_directions()
+        self.target_cell = self.building
+        self.building = None
+        self.rebuilds += 1
+        return True
+
+    def _build_directions(self):
+        # Для каждой клетки выбираем соседа с наименьшим расстоянием (векторно).
+        # Диагональ разрешена, только если обе прямые клетки свободны — не режем углы.
+        rows, cols = self.dist.shape
+        big = np.iinfo(np.int32).max
+        dist = np.where(self.dist < 0, big, self.dist)
+        padded = np.pad(dist, 1, constant_values=big)
+        free = self.free.reshape(-1, self.width)
+        best = dist.copy()
+        self.step_c.fill(0)
+        self.step_r.fill(0)
+        for dc, dr in NEIGHBOURS:
+            neighbour = padded[1 + dr:1 + dr + rows, 1 + dc:1 + dc + cols]
+            if dc and dr:
+                corner_ok = (free[1 + dr:1 + dr + rows, 1:1 + cols] &
+                             free[1:1 + rows, 1 + dc:1 + dc + cols])
+                neighbour = np.where(corner_ok, neighbour, big)
+            better = neighbour < best
+            best = np.where(better, neighbour, best)
+            self.step_c[better] = dc
+            self.step_r[better] = dr
+
+    def next_step(self, x, y):
+        # Центр следующей клетки пути или None, если отсюда до игрока пути нет
+        grid = self.grid
+        col, row = grid.cell_of(x, y)
+        if not (0 <= col < grid.cols and 0 <= row < grid.rows) or self.dist[row, col] <= 0:
+            return None
+        dc = int(self.step_c[row, col])
+        dr = int(self.step_r[row, col])
+        if dc == 0 and dr == 0:
+            return None
+        return (col + dc + 0.5) * grid.tile_w, (row + dr + 0.5) * grid.tile_h
+
+    def stats(self):
+        return {
+            "rebuilds": self.rebuilds,
+            "avg_rebuild_ms": self.rebuild_time * 1000 / max(self.rebuilds, 1),
+            "max_step_ms": round(self.max_step_ms, 3),
+            "reachable": int((self.dist >= 0).sum()),
+        }
+
+
+def segment_hits_rect(x0, y0, x1, y1, left, bottom, right, top):
+    # Слэб-тест отрезка с прямоугольником: доля пути t до входа или None
+    t_enter, t_exit = 0.0, 1.0
+    for start, delta, low, high in ((x0, x1 - x0, left, right), (y0, y1 - y0, bottom, top)):
+        if delta == 0:
+            if start < low or start > high:
+                return None
+            continue
+        t1 = (low - start) / delta
+        t2 = (high - start) / delta
+        if t1 > t2:
+            t1, t2 = t2, t1
+        t_enter = max(t_enter, t1)
+        t_exit = min(t_exit, t2)
+        if t_enter > t_exit:
+            return None
+    return t_enter
+
+
+class BroadPhase:
+    # Динамическая равномерная сетка для пуль и взрывов игрока: в клетках лежат слоты
+    # живых актёров, прямоугольники — из ActorStore.pos/half (спрайты не трогаем).
+    # Как ActivityZones, сетка не строится заново: rebuild() векторно сравнивает диапазоны
+    # клеток с прошлыми и перекладывает только тех, кто перешёл в другие клетки,
+    # родился или умер, — спящие и стоящие на месте ничего не стоят.
+    def __init__(self, cell_size=BROADPHASE_CELL):
+        self.cell_size = cell_size
+        self.cells = {}  # (столбец, строка) -> слоты актёров в клетке
+        self.store = None
+        self.placed = None  # Слоты, разложенные по клеткам
+        self.first = None  # Диапазоны клеток разложенных слотов: (столбец, строка) нижней левой
+        self.last = None  # и верхней правой
+        self.low = None  # Прямоугольники актёров на момент rebuild()
+        self.high = None
+        self.rebuilds = 0
+        self.moved = 0
+        self.queries = 0
+        self.candidates = 0
+
+    def _cell_range(self, left, bottom, right, top):
+        size = self.cell_size
+        return int(left // size), int(bottom // size), int(right // size), int(top // size)
+
+    def rebuild(self, store):
+        self.rebuilds += 1
+        if store is not self.store or self.placed.size != store.capacity:
+            # Новое хранилище или оно выросло — раскладываем всех заново
+            self.store = store
+            self.cells.clear()
+            self.placed = np.zeros(store.capacity, dtype=bool)
+            self.first = np.zeros((store.capacity, 2), dtype=np.int64)
+            self.last = np.zeros((store.capacity, 2), dtype=np.int64)
+        self.low = store.pos - store.half
+        self.high = store.pos + store.half
+        first = np.floor_divide(self.low, self.cell_size).astype(np.int64)
+        last = np.floor_divide(self.high, self.cell_size).astype(np.int64)
+        alive = store.alive
+        moved = (alive != self.placed) | (alive & ((first != self.first) | (last != self.last)).any(axis=1))
+        cells = self.cells
+        for slot in np.flatnonzero(moved).tolist():
+            if self.placed[slot]:
+                (c0, r0), (c1, r1) = self.first[slot].tolist(), self.last[slot].tolist()
+                for row in range(r0, r1 + 1):
+                    for col in range(c0, c1 + 1):
+                        cells[(col, row)].remove(slot)
+            if alive[slot]:
+                (c0, r0), (c1, r1) = first[slot].tolist(), last[slot].tolist()
+                for row in range(r0, r1 + 1):
+                    for col in range(c0, c1 + 1):
+                        cells.setdefault((col, row), []).append(slot)
+        self.moved += int(moved.sum())
+        self.placed = alive.copy()
+        self.first = first
+        self.last = last
+
+    def _candidates(self, left, bottom, right, top):
+        # Слоты из клеток прямоугольника, каждый один раз
+        self.queries += 1
+        alive = self.store.alive
+        seen = set()
+        c0, r0, c1, r1 = self._cell_range(left, bottom, right, top)
+        for row in range(r0, r1 + 1):
+            for col in range(c0, c1 + 1):
+                for slot in self.cells.get((col, row), ()):
+                    # Убитые в этом шаге уже без слота — пропускаем
+                    if slot in seen or not alive[slot]:
+                        continue
+                    seen.add(slot)
+                    self.candidates += 1
+                    yield slot
+
+    def query_segment(self, x0, y0, x1, y1, radius):
+        # Пуля за шаг прошла отрезок (x0, y0) -> (x1, y1). Возвращает список
+        # попаданий (t, спрайт), отсортированный по тому, кого задели раньше.
+        hits = []
+        for slot in self._candidates(min(x0, x1) - radius, min(y0, y1) - radius,
+                                     max(x0, x1) + radius, max(y0, y1) + radius):
+            (left, bottom), (right, top) = self.low[slot].tolist(), self.high[slot].tolist()
+            t = segment_hits_rect(x0, y0, x1, y1, left - radius, bottom - radius, right + radius, top + radius)
+            if t is not None:
+                hits.append((t, self.store.sprites[slot]))
+        hits.sort(key=lambda hit: hit[0])
+        return hits
+
+    def query_rect(self, left, bottom, right, top):
+        # Все, чей прямоугольник пересекается с данным (взрыв): список спрайтов
+        hits = []
+        for slot in self._candidates(left, bottom, right, top):
+            (l, b), (r, t) = self.low[slot].tolist(), self.high[slot].tolist()
+            if l < right and r > left and b < top and t > bottom:
+                hits.append(self.store.sprites[slot])
+        return hits
+
+    def stats(self):
+        return {
+            "cells": sum(1 for bucket in self.cells.values() if bucket),
+            "rebuilds": self.rebuilds,
+            "moved": self.moved,
+            "queries": self.queries,
+            "candidates": self.candidates,
+        }
+
+
+def bench_flow_field(map_name="testik1.tmx", scale=4, enemies=500, moves=200, search_ticks=3, seed=0):
+    # Бенчмарк: карта уровня с увеличенной в scale раз сеткой, сотни врагов.
+    # Сравниваем одно общее поле против отдельного поиска пути для каждого врага
+    # (его честно запускаем для всех врагов, но только в первых search_ticks тиках — он долгий).
+    rng = random.Random(seed)
+    tile_map = arcade.load_tilemap(map_name, scaling=TILE_SCALING)
+    base = CollisionGrid.from_sprite_list(
+        tile_map.sprite_lists["collision"], tile_map.width, tile_map.height,
+        tile_map.tile_width * TILE_SCALING, tile_map.tile_height * TILE_SCALING,
+    )
+    # Каждая клетка превращается в scale x scale клеток: связность карты сохраняется
+    grid = CollisionGrid(base.cols * scale, base.rows * scale, base.tile_w / scale, base.tile_h / scale)
+    grid.solid[:] = np.repeat(np.repeat(base.solid, scale, axis=0), scale, axis=1)
+    free_cells = np.argwhere(~grid.solid)
+    physics = WorldPhysics()
+    physics.reset(grid, np.zeros_like(grid.solid))
+    field = FlowField(physics, max_steps=grid.cols * grid.rows)
+    free = (~physics.blocked).ravel().tolist()  # Для поиска каждого врага — один раз, а не на каждый вызов
+
+    def random_point():
+        row, col = free_cells[rng.randrange(len(free_cells))]
+        return (col + 0.5) * grid.tile_w, (row + 0.5) * grid.tile_h
+
+    def search(start, goal):
+        # Поиск пути одного врага — обычный BFS до клетки игрока
+        width = field.width
+        goal = (goal[1] + 1) * width + goal[0] + 1
+        seen = {(start[1] + 1) * width + start[0] + 1}
+        frontier = list(seen)
+        while frontier and goal not in seen:
+            next_frontier = []
+            for i in frontier:
+                for j in (i + 1, i - 1, i + width, i - width):
+                    if free[j] and j not in seen:
+                        seen.add(j)
+                        next_frontier.append(j)
+            frontier = next_frontier
+        return goal in seen
+
+    chasers = [random_point() for _ in range(enemies)]
+    player_x, player_y = random_point()
+    query_time = 0.0
+    search_time = 0.0
+    step_time = []
+    for tick in range(moves):
+        # Игрок делает шаг в случайную свободную соседнюю клетку
+        col, row = grid.cell_of(player_x, player_y)
+        options = [(col + dc, row + dr) for dc, dr in NEIGHBOURS[:4]
+                   if not grid.is_solid_cell(col + dc, row + dr)]
+        if options:
+            col, row = rng.choice(options)
+            player_x, player_y = (col + 0.5) * grid.tile_w, (row + 0.5) * grid.tile_h
+        start = time.perf_counter()
+        field.update(player_x, player_y)
+        for x, y in chasers:
+            field.next_step(x, y)
+        step_time.append(time.perf_counter() - start)
+        query_time += step_time[-1]
+        if tick < search_ticks:
+            start = time.perf_counter()
+            for x, y in chasers:
+                search(grid.cell_of(x, y), (col, row))
+            search_time += time.perf_counter() - start
+
+    step_time.sort()
+    return {
+        "map": f"{grid.cols}x{grid.rows}",
+        "enemies": enemies,
+        "flow_rebuilds": field.rebuilds,
+        "flow_rebuild_ms": round(field.rebuild_time * 1000 / max(field.rebuilds, 1), 3),
+        "flow_max_step_ms": round(field.max_step_ms, 3),
+        "shared_field_ms_per_tick": round(query_time * 1000 / moves, 3),
+        "shared_field_p99_ms": round(step_time[int(len(step_time) * 0.99)] * 1000, 3),
+        "per_enemy_search_ms_per_tick": round(search_time * 1000 / max(min(search_ticks, moves), 1), 3),
+    }
+
+
+class WorldPhysics:
+    # Один проход движения для всех подвижных тел: игрок и проснувшиеся актёры
+    # двигаются сначала по X, потом по Y и упираются в сетку стен и закрытых дверей.
+    # Прямоугольник проверяется по таблице префиксных сумм за O(1) — сразу для всех тел.
+    # Стоящие на месте (турели, ждущие враги) не проверяются вовсе.
+    def __init__(self):
+        self.grid = None
+        self.tile = None
+        self.limit = None  # Последний индекс клетки вместе с рамкой
+        self.doors = None  # Клетки закрытых дверей
+        self.blocked = None  # Стены и закрытые двери с рамкой в одну клетку (её же берёт FlowField)
+        self.revision = 0  # Растёт при каждом изменении blocked
+        self.sums = None
+        self.bodies = 0
+        self.skipped = 0
+        self.contacts = 0
+        self.contacts_total = 0
+
+    def reset(self, grid, doors):
+        # doors — булева сетка закрытых дверей (из TileState)
+        self.grid = grid
+        self.tile = np.array([grid.tile_w, grid.tile_h])
+        self.limit = np.array([grid.cols + 1, grid.rows + 1])
+        self.doors = doors.copy()
+        self._rebuild()
+
+    def unblock(self, cells):
+        for col, row in cells:
+            self.doors[row, col] = False
+        self._rebuild()
+
+    def _rebuild(self):
+        # За краем карты — стена: сетка обложена рамкой из занятых клеток
+        blocked = np.pad(self.grid.solid | self.doors, 1, constant_values=True)
+        self.blocked = blocked
+        self.revision += 1
+        self.sums = np.zeros((blocked.shape[0] + 1, blocked.shape[1] + 1), dtype=np.int32)
+        self.sums[1:, 1:] = blocked.cumsum(axis=0).cumsum(axis=1)
+
+    def _blocked(self, pos, half):
+        # Есть ли занятые клетки под прямоугольниками тел (край ровно по границе клетки не считается)
+        lo = np.floor((pos - half) / self.tile).astype(np.int64) + 1  # +1 — рамка вокруг сетки
+        hi = np.ceil((pos + half) / self.tile).astype(np.int64) + 1
+        np.minimum(np.maximum(lo, 0, out=lo), self.limit, out=lo)
+        np.minimum(np.maximum(hi, 0, out=hi), self.limit + 1, out=hi)
+        s = self.sums
+        return s[hi[:, 1], hi[:, 0]] - s[lo[:, 1], hi[:, 0]] - s[hi[:, 1], lo[:, 0]] + s[lo[:, 1], lo[:, 0]] > 0
+
+    def _move_axis(self, pos, vel, half, axis):
+        tile = self.tile[axis]
+        old = pos[:, axis].copy()
+        moving = vel[:, axis] != 0
+        pos[moving, axis] += vel[moving, axis]
+        hit = moving & self._blocked(pos, half)
+        if hit.any():
+            # Прижимаемся к краю клетки, в которую въехали
+            forward = hit & (vel[:, axis] > 0)
+            back = hit & (vel[:, axis] < 0)
+            edge = np.ceil((pos[forward, axis] + half[forward, axis]) / tile) - 1
+            pos[forward, axis] = edge * tile - half[forward, axis]
+            edge = np.floor((pos[back, axis] - half[back, axis]) / tile) + 1
+            pos[back, axis] = edge * tile + half[back, axis]
+            stuck = hit & self._blocked(pos, half)
+            pos[stuck, axis] = old[stuck]  # Уже сидели в стене — просто не двигаемся
+            self.contacts += int(hit.sum())
+        return old
+
+    def step(self, player, blockers, store, slots, steps):
+        # player — спрайт игрока (ещё и упирается в blockers), slots — проснувшиеся актёры,
+        # steps — сколько шагов накопил каждый (средняя зона обновляется раз в ZONE_NEAR_EVERY
+        # шагов и за раз проходит весь путь; скорость в store.vel — в пикселях за шаг)
+        alive = store.alive[slots]  # Кого-то могли убить за этот шаг
+        slots, steps = slots[alive], steps[alive]
+        moving = (store.vel[slots] != 0).any(axis=1)
+        self.skipped = len(slots) - int(moving.sum())
+        slots, steps = slots[moving], steps[moving]
+        self.bodies = len(slots) + 1
+        self.contacts = 0
+
+        points = player.hit_box.get_adjusted_points()
+        xs = [px for px, _ in points]
+        ys = [py for _, py in points]
+        pos = np.empty((self.bodies, 2))
+        vel = np.empty((self.bodies, 2))
+        half = np.empty((self.bodies, 2))
+        pos[0] = player.center_x, player.center_y
+        vel[0] = player.change_x, player.change_y
+        half[0] = (max(xs) - min(xs)) / 2, (max(ys) - min(ys)) / 2
+        pos[1:] = store.pos[slots]
+        vel[1:] = store.vel[slots] * steps[:, None]
+        half[1:] = store.half[slots]
+
+        for axis in (0, 1):
+            old = self._move_axis(pos, vel, half, axis)
+            if blockers and vel[0, axis] != 0:
+                player.position = pos[0].tolist()
+                if arcade.check_for_collision_with_list(player, blockers):
+                    pos[0, axis] = old[0]
+                    self.contacts += 1
+        player.position = pos[0].tolist()
+
+        store.pos[slots] = pos[1:]
+        for slot, xy in zip(slots.tolist(), pos[1:].tolist()):
+            store.sprites[slot].position = xy
+        self.contacts_total += self.contacts
+
+    def stats(self):
+        return {
+            "bodies": self.bodies,
+            "static_skipped": self.skipped,
+            "contacts": self.contacts,
+            "contacts_total": self.contacts_total,
+            "door_cells": int(self.doors.sum()) if self.doors is not None else 0,
+        }
+
+
+class TileState:
+    # Изменяемые тайлы уровня (двери, бочки, сундуки, выход) — сетка видов и спрайт по клетке.
+    # Проверки «игрок стоит на сундуке» и «пуля влетела в бочку» — поиск по сетке, а не по спискам.
+    # Изменение (дверь открылась, бочка разбита) сразу меняет сетку и записывается событием;
+    # flush() раз в шаг переносит события в физику, запечённые чанки и списки спрайтов.
+    def __init__(self, physics, chunks):
+        self.physics = physics
+        self.chunks = chunks
+        self.grid = None
+        self.kind = None
+        self.sprites = {}  # (столбец, строка) -> спрайт тайла
+        self.shootable = None  # CollisionGrid с клетками, в которые упирается пуля
+        self.events = []  # (событие, столбец, строка), ещё не перенесённые в кэши
+        self.applied = {}  # Сколько событий каждого вида уже перенесено
+
+    def reset(self, grid, sprite_lists):
+        self.grid = grid
+        self.kind = np.zeros((grid.rows, grid.cols), dtype=np.int8)
+        self.sprites.clear()
+        self.events.clear()
+        for name, kind in TILE_KINDS.items():
+            for sprite in sprite_lists[name]:
+                col, row = grid.cell_of(sprite.center_x, sprite.center_y)
+                self.kind[row, col] = kind
+                self.sprites[(col, row)] = sprite
+        self.shootable = CollisionGrid(grid.cols, grid.rows, grid.tile_w, grid.tile_h)
+        self.shootable.solid = np.isin(self.kind, (TILE_DOOR, TILE_BARREL))
+
+    def touching(self, sprite, kind):
+        # Тайлы вида kind под хитбоксом спрайта (касание краем не считается)
+        grid = self.grid
+        c0, r0 = max(int(sprite.left // grid.tile_w), 0), max(int(sprite.bottom // grid.tile_h), 0)
+        c1 = min(math.ceil(sprite.right / grid.tile_w), grid.cols)
+        r1 = min(math.ceil(sprite.top / grid.tile_h), grid.rows)
+        rows, cols = np.nonzero(self.kind[r0:r1, c0:c1] == kind)
+        return [self.sprites[(c0 + col, r0 + row)] for row, col in zip(rows.tolist(), cols.tolist())]
+
+    def segment_hit(self, x0, y0, x1, y1):
+        # Первая дверь или бочка на отрезке: (t, вид, спрайт) или None
+        t = self.shootable.segment_hit(x0, y0, x1, y1)
+        if t is None:
+            return None
+        length = math.hypot(x1 - x0, y1 - y0) or 1.0
+        t_in = min(t + 0.5 / length, 1.0)  # Чуть вглубь — в саму клетку, а не на её край
+        col, row = self.grid.cell_of(x0 + (x1 - x0) * t_in, y0 + (y1 - y0) * t_in)
+        if not (0 <= col < self.grid.cols and 0 <= row < self.grid.rows) or not self.kind[row, col]:
+            return None  # Край карты — это уже дело стен
+        return t, int(self.kind[row, col]), self.sprites[(col, row)]
+
+    def _change(self, event, col, row):
+        self.kind[row, col] = 0
+        self.shootable.solid[row, col] = False
+        self.events.append((event, col, row))
+
+    def open_doors(self):
+        for row, col in np.argwhere(self.kind == TILE_DOOR).tolist():
+            self._change("door_opened", col, row)
+
+    def break_barrel(self, sprite):
+        # False — бочку в этом шаге уже разбили
+        col, row = self.grid.cell_of(sprite.center_x, sprite.center_y)
+        if self.kind[row, col] != TILE_BARREL:
+            return False
+        self._change("barrel_broken", col, row)
+        return True
+
+    def flush(self):
+        if not self.events:
+            return
+        opened = []
+        for event, col, row in self.events:
+            sprite = self.sprites.pop((col, row))
+            self.chunks.invalidate(sprite)
+            sprite.remove_from_sprite_lists()
+            if event == "door_opened":
+                opened.append((col, row))
+            self.applied[event] = self.applied.get(event, 0) + 1
+        if opened:
+            self.physics.unblock(opened)  # Таблица сумм пересчитывается один раз на все двери
+        self.events.clear()
+
+    def stats(self):
+        counts = np.bincount(self.kind.ravel(), minlength=len(TILE_KINDS) + 1) if self.kind is not None else []
+        return {
+            "tiles": {name: int(counts[kind]) for name, kind in TILE_KINDS.items()} if len(counts) else {},
+            "pending": len(self.events),
+            "applied": dict(self.applied),
+        }
+
+
+class EventBus:
+    # Игровые события шага: урон, подбор, взрыв, смерть, звук. Лежат в заранее выделенных
+    # массивах (никаких объектов на событие) и разбираются раз в шаг пачкой в drain():
+    # весь урон одному получателю складывается в одно изменение здоровья, одинаковые
+    # звуки за шаг играют один раз. hooks получают каждую пачку целиком — для записи,
+    # а replay() кладёт записанную пачку обратно в очередь.
+    def __init__(self, capacity=EVENT_CAPACITY):
+        self.capacity = capacity
+        self.kind = np.zeros(capacity, dtype=np.int8)
+        self.target = np.zeros(capacity, dtype=np.int32)  # Слот актёра, TARGET_PLAYER, вид лута, номер звука...
+        self.pos = np.zeros((capacity, 2))
+        self.value = np.zeros(capacity)  # Урон, громкость и т.п.
+        self.count = 0
+        self.high_water = 0
+        self.dropped = 0
+        self.coalesced = 0  # Сколько событий слилось с другими
+        self.totals = np.zeros(len(EVENT_NAMES), dtype=np.int64)
+        self.hooks = []  # hook(kind, target, pos, value) — срезы массивов, копировать самому
+
+    def emit(self, kind, target=0, x=0.0, y=0.0, value=0.0):
+        n = self.count
+        if n == self.capacity:
+            self.dropped += 1
+            return
+        self.kind[n] = kind
+        self.target[n] = target
+        self.pos[n, 0] = x
+        self.pos[n, 1] = y
+        self.value[n] = value
+        self.count = n + 1
+
+    def replay(self, kind, target, pos, value):
+        n = min(len(kind), self.capacity - self.count)
+        self.dropped += len(kind) - n
+        batch = slice(self.count, self.count + n)
+        self.kind[batch] = kind[:n]
+        self.target[batch] = target[:n]
+        self.pos[batch] = pos[:n]
+        self.value[batch] = value[:n]
+        self.count += n
+
+    def clear(self):
+        self.count = 0
+
+    def drain(self, view):
+        # Смерти и звуки, порождённые разбором, попадают в ту же очередь — разбираем до конца
+        start = 0
+        while start < self.count:
+            end = self.count
+            self.high_water = max(self.high_water, end)
+            for hook in self.hooks:
+                hook(self.kind[start:end], self.target[start:end], self.pos[start:end], self.value[start:end])
+            self._apply(view, start, end)
+            start = end
+        self.count = 0
+        view.actors.pending[:] = 0
+
+    def _apply(self, view, start, end):
+        kind = self.kind[start:end]
+        target = self.target[start:end]
+        pos = self.pos[start:end]
+        value = self.value[start:end]
+        self.totals += np.bincount(kind, minlength=len(EVENT_NAMES))
+
+        damage = kind == EV_DAMAGE
+        if damage.any():
+            to_player = damage & (target == TARGET_PLAYER)
+            if to_player.any():
+                view.player_hp -= int(value[to_player].sum())
+                self.coalesced += int(to_player.sum()) - 1
+            store = view.actors
+            slots = target[damage & (target >= 0)]
+            amounts = value[damage & (target >= 0)]
+            alive = store.alive[slots]
+            slots, amounts = slots[alive], amounts[alive]  # По уже убитым урон не идёт
+            if len(slots):
+                np.subtract.at(store.health, slots, amounts)
+                hurt = np.unique(slots)
+                self.coalesced += len(slots) - len(hurt)
+                for slot in hurt[store.health[hurt] <= 0].tolist():
+                    x, y = store.pos[slot].tolist()
+                    self.emit(EV_DEATH, slot, x, y)
+
+        pickup = kind == EV_PICKUP
+        if pickup.any():
+            found = np.bincount(target[pickup], minlength=len(RANDOM_LOOT))
+            view.player_hp += 30 * int(found[RANDOM_LOOT.index('heal')])
+            view.count_bomb += int(found[RANDOM_LOOT.index('bomb')])
+
+        for n in np.flatnonzero(kind == EV_EXPLOSION).tolist():
+            owner = 'boss' if target[n] == OWNER_IDS['boss'] else 'friend'
+            view.spawn_boom(pos[n, 0], pos[n, 1], value[n], owner=owner)
+
+        for n in np.flatnonzero(kind == EV_DEATH).tolist():
+            sprite = view.actors.sprites[target[n]]
+            if sprite is None:
+                continue
+            sprite.remove_from_sprite_lists()
+            view.emitters.spawn(make_explosion(pos[n, 0], pos[n, 1]))
+            self.emit(EV_SOUND, SOUND_ENEMY_DEAD)
+
+        sound = kind == EV_SOUND
+        if sound.any():
+            ids = np.unique(target[sound])
+            self.coalesced += int(sound.sum()) - len(ids)
+            for sound_id in ids.tolist():
+                AUDIO.play(sound_id)
+
+    def stats(self):
+        return {
+            "totals": dict(zip(EVENT_NAMES, self.totals.tolist())),
+            "coalesced": self.coalesced,
+            "high_water": self.high_water,
+            "dropped": self.dropped,
+        }
+
+
+class ProjectileEngine:
+    # Все пули хранятся как структура массивов: один векторный шаг на кадр
+    # вместо update() у каждого спрайта. Спрайты нужны только для отрисовки.
+    def __init__(self, capacity, bounds=(0, 0, 4000, 4000)):
+        self.capacity = capacity
+        self.bounds = bounds
+        self.grid = None
+        self.pos = np.zeros((capacity, 2))
+        self.prev = np.zeros((capacity, 2))  # Позиция до шага: пуля проверяется по всему отрезку
+        self.vel = np.zeros((capacity, 2))
+        self.radius = np.zeros(capacity)
+        self.age = np.zeros(capacity)
+        self.lifetime = np.zeros(capacity)
+        self.owner = np.zeros(capacity, dtype=np.int8)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.sprites = [None] * capacity
+        self.free_slots = list(range(capacity - 1, -1, -1))
+
+    def add(self, sprite, lifetime=BULLET_LIFETIME):
+        slot = self.free_slots.pop()
+        self.pos[slot] = sprite.center_x, sprite.center_y
+        self.prev[slot] = self.pos[slot]
+        self.vel[slot] = sprite.change_x, sprite.change_y
+        self.radius[slot] = min(sprite.width, sprite.height) / 2
+        self.age[slot] = 0
+        self.lifetime[slot] = lifetime
+        self.owner[slot] = OWNER_IDS[sprite.owner]
+        self.alive[slot] = True
+        self.sprites[slot] = sprite
+        sprite.engine = self
+        sprite.slot = slot
+
+    def remove(self, sprite):
+        slot = sprite.slot
+        if slot < 0:
+            return
+        self.alive[slot] = False
+        self.sprites[slot] = None
+        self.free_slots.append(slot)
+        sprite.slot = -1
+
+    def step(self, dt):
+        # Возвращает пули, влетевшие в стену: что с ними делать, решает GameView
+        live = np.flatnonzero(self.alive)
+        if live.size == 0:
+            return []
+        self.prev[live] = self.pos[live]
+        self.pos[live] += self.vel[live] * dt
+        self.age[live] += dt
+
+        x = self.pos[live, 0]
+        y = self.pos[live, 1]
+        left, bottom, right, top = self.bounds
+        dead = ((x < left) | (x > right) | (y < bottom) | (y > top) |
+                (self.age[live] > self.lifetime[live]))
+        if self.grid is not None:
+            wall = self._sweep_walls(live, ~dead)
+        else:
+            wall = np.zeros(live.size, dtype=bool)
+
+        for slot in live[dead].tolist():
+            self.sprites[slot].release()
+
+        # В спрайты переносим только живые пули
+        keep = live[~dead]
+        for slot, xy in zip(keep.tolist(), self.pos[keep].tolist()):
+            self.sprites[slot].position = xy
+        return [self.sprites[slot] for slot in live[wall].tolist()]
+
+    def _sweep_walls(self, live, candidates):
+        # Пуля, оставшаяся в своей клетке, проверяется одной векторной проверкой точки.
+        # Пересёкшие границу клеток проходят по сетке (DDA) и останавливаются
+        # в точке входа в стену — даже если за кадр пролетели несколько тайлов.
+        grid = self.grid
+        start = self.prev[live]
+        end = self.pos[live]
+        tile = (grid.tile_w, grid.tile_h)
+        same_cell = (np.floor_divide(start, tile) == np.floor_divide(end, tile)).all(axis=1)
+        wall = candidates & same_cell & grid.solid_at_points(end[:, 0], end[:, 1])
+        for i in np.flatnonzero(candidates & ~same_cell).tolist():
+            (x0, y0), (x1, y1) = start[i].tolist(), end[i].tolist()
+            t = grid.segment_hit(x0, y0, x1, y1)
+            if t is not None:
+                self.pos[live[i]] = x0 + (x1 - x0) * t, y0 + (y1 - y0) * t
+                wall[i] = True
+        return wall
+
+    def segment(self, sprite):
+        (x0, y0), (x1, y1) = self.prev[sprite.slot].tolist(), self.pos[sprite.slot].tolist()
+        return x0, y0, x1, y1
+
+    def sweep_rect(self, left, bottom, right, top, owners):
+        # Какие пули указанных владельцев за последний шаг прошли через прямоугольник.
+        # Векторный слэб-тест: прямоугольник расширен на радиус каждой пули.
+        live = np.flatnonzero(self.alive & np.isin(self.owner, owners))
+        if live.size == 0:
+            return []
+        start = self.prev[live]
+        delta = self.pos[live] - start
+        radius = self.radius[live, None]
+        low = np.array([left, bottom]) - radius
+        high = np.array([right, top]) + radius
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t1 = (low - start) / delta
+            t2 = (high - start) / delta
+        inside = (start >= low) & (start <= high)
+        still = delta == 0
+        t_min = np.where(still, np.where(inside, -np.inf, np.inf), np.minimum(t1, t2))
+        t_max = np.where(still, np.where(inside, np.inf, -np.inf), np.maximum(t1, t2))
+        t_enter = np.maximum(t_min.max(axis=1), 0.0)
+        t_exit = np.minimum(t_max.min(axis=1), 1.0)
+        return [self.sprites[slot] for slot in live[t_enter <= t_exit].tolist()]
+
+    def render_sync(self, alpha):
+        # Для отрисовки ставим пули между прошлой и текущей позицией.
+        # Следующий step() сам вернёт спрайтам настоящие координаты.
+        live = np.flatnonzero(self.alive)
+        drawn = self.prev[live] + (self.pos[live] - self.prev[live]) * alpha
+        for slot, xy in zip(live.tolist(), drawn.tolist()):
+            self.sprites[slot].position = xy
+
+    def count(self):
+        return int(self.alive.sum())
+
+    def stats(self):
+        per_owner = np.bincount(self.owner[self.alive], minlength=len(OWNER_IDS))
+        return {name: int(per_owner[i]) for name, i in OWNER_IDS.items()}
+
+
+class Bullet(PooledSprite):
+    def __init__(self):
         super().__init__()
+        self.engine = None
+        self.slot = -1
+
+    def release(self):
+        if self.engine is not None:
+            self.engine.remove(self)
+        super().release()
+
+    def reset(self, start_x, start_y, target_x, target_y,
+              speed=800, damage=50, owner="player"):
+        # Переинициализация на месте — вместо создания новой пули
+        self.damage_boom = 0
         if owner == "player":
-            self.texture = arcade.load_texture("laser_2.png")
+            self.texture = ASSETS.texture("laser_2.png")
             self.scale = 0.2
 
         elif owner == 'boss':
-            self.texture = arcade.load_texture("laser_1.png")
+            self.texture = ASSETS.texture("laser_1.png")
             self.damage_boom = 200
             self.scale = 0.7
         else:
-            self.texture = arcade.load_texture("laser_1.png")
+            self.texture = ASSETS.texture("laser_1.png")
             self.scale = 0.4
 
         self.center_x = start_x
@@ -300,252 +2569,241 @@ class Bullet(arcade.Sprite):
         self.change_x = math.cos(angle) * speed
         self.change_y = math.sin(angle) * speed
         self.angle = math.degrees(-angle)
+        return self
 
-    def update(self, delta_time):
-        if (self.center_x < 0 or self.center_x > 4000 or
-                self.center_y < 0 or self.center_y > 4000):
-            self.remove_from_sprite_lists()
-
-        self.center_x += self.change_x * delta_time
-        self.center_y += self.change_y * delta_time
-
-
-class Turrel(arcade.Sprite):
-    def __init__(self, game_view, player, x, y):
-        super().__init__()
-        self.game_view = game_view
-        self.health = 200
-        self.texture = arcade.load_texture("enemy.png")
-        self.scale = 1
-        self.player = player
-        self.center_x = x
-        self.center_y = y
-        self.bullet_list = arcade.SpriteList()
-
-        self.timer = 0
-        self.interval = random.uniform(0.5, 2.0)
 
-        self.physics_engine = arcade.PhysicsEngineSimple(
-            self,
-            [self.game_view.collision_list,
-             self.game_view.doors_list]
-        )
-
-    def shoot(self):
-        # Передаем координаты в Bullet
-        bullet = Bullet(
-            self.center_x,
-            self.center_y,
-            self.player.center_x, self.player.center_y,
-            owner='enemy'
-        )
-        self.bullet_list.append(bullet)
-
-    def update(self, delta_time):
-        self.bullet_list.update()
-
-        self.timer += delta_time
-
-        for bullet in self.bullet_list:
-            if arcade.check_for_collision_with_list(bullet, self.game_view.collision_list):
-                bullet.remove_from_sprite_lists()
-                continue
+class StoreField:
+    # Поле актёра, которое на самом деле лежит в массиве ActorStore
+    def __init__(self, name):
+        self.name = name
 
-            if arcade.check_for_collision(bullet, self.player):
-                bullet.remove_from_sprite_lists()
-                self.game_view.player_hp -= bullet.damage
+    def __get__(self, actor, owner=None):
+        if actor is None:
+            return self
+        return getattr(actor.store, self.name)[actor.slot].item()
+
+    def __set__(self, actor, value):
+        getattr(actor.store, self.name)[actor.slot] = value
+
+
+class ActorStore:
+    # Данные всех актёров (Enemy, Boss, Turrel) — в упакованных массивах, по слоту на актёра.
+    # Спрайты нужны только для отрисовки и столкновений; системы step() (таймеры, пульсация,
+    # зрение, движение, стрельба) проходят по массивам разом, а не через update() каждого.
+    FIELDS = {  # Имя массива -> (тип, форма одной записи)
+        "alive": (bool, ()),
+        "faction": (np.int8, ()),  # OWNER_IDS
+        "health": (np.float64, ()),
+        "pending": (np.float64, ()),  # Урон, выпущенный в этом шаге, но ещё не применённый в drain()
+        "pos": (np.float64, (2,)),
+        "vel": (np.float64, (2,)),
+        "speed": (np.float64, ()),
+        "timer": (np.float64, ()),  # Стрельба: сколько прошло и сколько ждать
+        "interval": (np.float64, ()),
+        "vision_timer": (np.float64, ()),
+        "sight_range": (np.float64, ()),
+        "can_see": (bool, ()),
+        "alerted": (bool, ()),  # Видел игрока — ищет его по полю путей
+        "chases": (bool, ()),
+        "pulse": (bool, ()),
+        "pulse_dir": (np.float64, ()),
+        "size": (np.float64, ()),
+        "half": (np.float64, (2,)),  # Полуразмеры хитбокса для WorldPhysics
+        "flow_target": (np.float64, (2,)),
+        "has_target": (bool, ()),
+        "ai_queued": (bool, ()),  # Для AIScheduler
+        "ai_since": (np.int64, ()),
+        "zone_cell": (np.int32, (2,)),  # Для ActivityZones
+        "zone_dt": (np.float64, ()),
+        "zone_phase": (np.int8, ()),
+    }
+
+    def __init__(self, view, capacity=ACTOR_CAPACITY):
+        self.view = view
+        self.capacity = 0
+        self.count = 0
+        self.sprites = []
+        self.free_slots = []
+        self._grow(capacity)
+
+    def _grow(self, capacity):
+        for name, (dtype, shape) in self.FIELDS.items():
+            array = np.zeros((capacity,) + shape, dtype=dtype)
+            if self.capacity:
+                array[:self.capacity] = getattr(self, name)
+            setattr(self, name, array)
+        self.sprites += [None] * (capacity - self.capacity)
+        # Сначала раздаём старые свободные слоты (они в конце стека)
+        self.free_slots = list(range(capacity - 1, self.capacity - 1, -1)) + self.free_slots
+        self.capacity = capacity
+
+    def add(self, sprite, owner, health, speed, interval, sight_range, chases=False, pulse=False):
+        if not self.free_slots:
+            self._grow(self.capacity * 2)
+        slot = self.free_slots.pop()
+        for name in self.FIELDS:
+            getattr(self, name)[slot] = 0
+        self.alive[slot] = True
+        self.faction[slot] = OWNER_IDS[owner]
+        self.health[slot] = health
+        self.pos[slot] = sprite.center_x, sprite.center_y
+        self.speed[slot] = speed
+        self.interval[slot] = interval
+        self.vision_timer[slot] = random.uniform(0, AI_THINK_INTERVAL)  # Разносим запросы по шагам
+        self.sight_range[slot] = sight_range
+        self.chases[slot] = chases
+        self.pulse[slot] = pulse
+        self.pulse_dir[slot] = 10
+        self.size[slot] = sprite.width
+        points = sprite.hit_box.get_adjusted_points()
+        self.half[slot] = ((max(x for x, _ in points) - min(x for x, _ in points)) / 2,
+                           (max(y for _, y in points) - min(y for _, y in points)) / 2)
+        self.sprites[slot] = sprite
+        self.count += 1
+        return slot
+
+    def lethal(self, slot):
+        # Уже выпущенного за шаг урона хватает на смерть: пули и взрывы такую цель пропускают
+        return self.health[slot] <= self.pending[slot]
+
+    def remove(self, sprite):
+        slot = sprite.slot
+        self.alive[slot] = False
+        self.sprites[slot] = None
+        self.free_slots.append(slot)
+        self.count -= 1
+        sprite.slot = None
+
+    def step(self, idx, dts, player):
+        # Все системы для проснувшихся актёров (idx — слоты, dts — их dt)
+        if not len(idx):
+            return
+        view = self.view
+        self.timer[idx] += dts
+        self.vision_timer[idx] += dts
+
+        # Эффект пульсации (у кого он есть)
+        pulsing = self.pulse[idx]
+        p = idx[pulsing]
+        width = self.size[p] + self.pulse_dir[p] * 1.5 * dts[pulsing]
+        flip = (width > 70) | (width < 58)
+        self.pulse_dir[p[flip]] *= -1
+        width = np.clip(width, 58, 70)
+        self.half[p] *= (width / self.size[p])[:, None]
+        self.size[p] = width
+        for slot, width in zip(p.tolist(), self.size[p].tolist()):
+            sprite = self.sprites[slot]
+            sprite.width = width
+            sprite.height = width
+
+        # Зрение: радиус, стены и путь посчитает AIScheduler, когда дойдёт очередь
+        due = idx[self.vision_timer[idx] > AI_THINK_INTERVAL]
+        self.vision_timer[due] = 0
+        for slot in due.tolist():
+            view.ai.request(slot)
+
+        # Движение: видим — прямо к игроку, не видим — по полю путей, если уже тревога
+        delta = np.array([player.center_x, player.center_y]) - self.pos[idx]
+        distance = np.sqrt((delta * delta).sum(axis=1))
+        see = self.can_see[idx]
+        self.alerted[idx[see]] = True
+        direct = see & (distance > 10)
+        self.vel[idx[direct]] = delta[direct] / distance[direct, None] * self.speed[idx[direct], None]
+        lost = ~see & self.alerted[idx] & self.has_target[idx]
+        self.vel[idx[~see & ~lost]] = 0
+        chasing = idx[lost]
+        delta = self.flow_target[chasing] - self.pos[chasing]
+        distance = np.sqrt((delta * delta).sum(axis=1))
+        going = distance > 1
+        # Средняя зона за раз проходит несколько шагов — не перелетаем клетку-цель
+        speed = np.minimum(self.speed[chasing], distance / np.rint(dts[lost] / SIM_DT))
+        self.vel[chasing[going]] = delta[going] / distance[going, None] * speed[going, None]
+        reached = chasing[~going]
+        self.has_target[reached] = False
+        for slot in reached.tolist():
+            view.ai.request(slot)  # Дошли до клетки — просим следующую, не дожидаясь таймера
+
+        # Стрельба
+        shooters = idx[see & (self.timer[idx] >= self.interval[idx])]
+        for slot in shooters.tolist():
+            self.sprites[slot].shoot()
+            self.timer[slot] = 0
+            self.interval[slot] = random.uniform(0.5, 1.0)
+
+    def stats(self):
+        alive = self.alive[:self.capacity]
+        factions = np.bincount(self.faction[alive], minlength=len(OWNER_IDS))
+        return {
+            "count": self.count,
+            "capacity": self.capacity,
+            "by_faction": dict(zip(OWNER_IDS, factions.tolist())),
+            "bytes": sum(getattr(self, name).nbytes for name in self.FIELDS),
+        }
 
-        if self.timer >= self.interval:
-            self.shoot()
-            self.timer = 0
-            self.interval = random.uniform(0.5, 1.0)
 
-        self.physics_engine.update()
+class Actor(arcade.Sprite):
+    # Общая часть Enemy, Boss и Turrel: спрайт плюс слот в ActorStore.
+    # health, timer, can_see и прочее — окна в массивы хранилища, в атрибутах спрайта их нет.
+    owner = 'enemy'
 
+    health = StoreField("health")
+    speed = StoreField("speed")
+    timer = StoreField("timer")
+    interval = StoreField("interval")
+    can_see = StoreField("can_see")
+    alerted = StoreField("alerted")
 
-class Enemy(arcade.Sprite):
-    def __init__(self, game_view, player, x, y):
-        super().__init__()
+    def __init__(self, game_view, player, x, y, texture, scale, **stats):
+        super().__init__(ASSETS.texture(texture), scale)
         self.game_view = game_view
-        self.health = 50
-        self.texture = arcade.load_texture("ufoGreen.png")
-        self.scale = 1.5
-        self.pulse_direction = 10
-        self.speed = 1.5
         self.player = player
         self.center_x = x
         self.center_y = y
-        self.bullet_list = arcade.SpriteList()
-
-        self.timer = 0
-        self.interval = random.uniform(0.5, 2.0)
-        self.vision_timer = 0
-        self.can_see = False
-
-        self.physics_engine = arcade.PhysicsEngineSimple(
-            self,
-            [self.game_view.collision_list,
-             self.game_view.doors_list]
-        )
+        self.store = game_view.actors
+        self.slot = self.store.add(self, self.owner, **stats)
 
     def shoot(self):
         # Передаем координаты в Bullet
-        bullet = Bullet(
+        self.game_view.spawn_bullet(
             self.center_x,
             self.center_y,
             self.player.center_x, self.player.center_y,
-            owner='enemy'
+            owner=self.owner
         )
-        self.bullet_list.append(bullet)
-
-    def update(self, delta_time):
-        self.bullet_list.update()
 
-        self.timer += delta_time
-        self.vision_timer += delta_time
+    def remove_from_sprite_lists(self):
+        super().remove_from_sprite_lists()
+        if self.slot is not None:
+            self.store.remove(self)  # Слот освобождается вместе со спрайтом
 
-        for bullet in self.bullet_list:
-            if arcade.check_for_collision_with_list(bullet, self.game_view.collision_list):
-                bullet.remove_from_sprite_lists()
-                continue
 
-            if arcade.check_for_collision(bullet, self.player):
-                bullet.remove_from_sprite_lists()
-                self.game_view.player_hp -= bullet.damage
-
-        # Эффект пульсации
-        new_width = self.width + self.pulse_direction * 1.5 * delta_time
-        if new_width > 70 or new_width < 58:
-            self.pulse_direction *= -1
-            new_width = max(58, min(70, new_width))
-        self.width = new_width
-        self.height = new_width
-
-        dx = self.player.center_x - self.center_x
-        dy = self.player.center_y - self.center_y
-        distance = math.sqrt(dx * dx + dy * dy)
-
-        # --- ЛОГИКА ЗРЕНИЯ ---
-        if self.vision_timer > 0.2:
-            self.vision_timer = 0
-            if distance < 500:  # Радиус обнаружения
-                # 2. Проверяем, нет ли стен между центром врага и центром игрока
-                self.can_see = arcade.has_line_of_sight(
-                    self.player.position,
-                    self.position,
-                    self.game_view.collision_list,
-                    check_resolution=16
-                )
-            else:
-                self.can_see = False
-
-        if self.can_see:
-            # Двигается к игроку
-            if distance > 10:
-                self.change_x = (dx / distance) * self.speed
-                self.change_y = (dy / distance) * self.speed
-
-            if self.timer >= self.interval:
-                self.shoot()
-                self.timer = 0
-                self.interval = random.uniform(0.5, 1.0)
-        else:
-            self.change_x = 0
-            self.change_y = 0
-
-        self.physics_engine.update()
-
-
-class Boss(arcade.Sprite):
+class Turrel(Actor):
     def __init__(self, game_view, player, x, y):
-        super().__init__()
-        self.game_view = game_view
-        self.health = 1000
-        self.texture = arcade.load_texture("ufoGreen.png")
-        self.scale = 3
-        self.speed = 1.5
-        self.player = player
-        self.center_x = x
-        self.center_y = y
-        self.bullet_list = arcade.SpriteList()
+        # Стоит на месте и стреляет, только если игрок близко и не за стеной
+        super().__init__(game_view, player, x, y, "enemy.png", 1,
+                         health=200, speed=0, interval=random.uniform(0.5, 2.0), sight_range=TURREL_RANGE)
 
-        self.timer = 0
-        self.interval = random.uniform(0.5, 1.3)
-        self.vision_timer = 0
-        self.can_see = False
-
-        self.physics_engine = arcade.PhysicsEngineSimple(
-            self,
-            [self.game_view.collision_list,
-             self.game_view.doors_list]
-        )
 
-    def shoot(self):
-        # Передаем координаты в Bullet
-        bullet = Bullet(
-            self.center_x,
-            self.center_y,
-            self.player.center_x, self.player.center_y,
-            owner='boss'
-        )
-        self.bullet_list.append(bullet)
-
-    def update(self, delta_time):
-        self.bullet_list.update()
+class Enemy(Actor):
+    def __init__(self, game_view, player, x, y):
+        super().__init__(game_view, player, x, y, "ufoGreen.png", 1.5,
+                         health=50, speed=1.5, interval=random.uniform(0.5, 2.0), sight_range=500,
+                         chases=True, pulse=True)
 
-        self.timer += delta_time
-        self.vision_timer += delta_time
 
-        for bullet in self.bullet_list:
-            if arcade.check_for_collision_with_list(bullet, self.game_view.collision_list):
-                boom = Booms(bullet.center_x, bullet.center_y, self.game_view, bullet, owner='boss')
-                self.game_view.boom_list.append(boom)
-                bullet.remove_from_sprite_lists()
-                continue
+class Boss(Actor):
+    owner = 'boss'
 
-            if arcade.check_for_collision(bullet, self.player):
-                bullet.remove_from_sprite_lists()
-                self.game_view.player_hp -= bullet.damage
-
-        dx = self.player.center_x - self.center_x
-        dy = self.player.center_y - self.center_y
-        distance = math.sqrt(dx * dx + dy * dy)
-
-        # --- ЛОГИКА ЗРЕНИЯ ---
-        if self.vision_timer > 0.2:
-            self.vision_timer = 0
-            if distance < 1000:  # Радиус обнаружения
-                # 2. Проверяем, нет ли стен между центром врага и центром игрока
-                self.can_see = arcade.has_line_of_sight(
-                    self.player.position,
-                    self.position,
-                    self.game_view.collision_list,
-                    check_resolution=16
-                )
-            else:
-                self.can_see = False
-
-        if self.can_see:
-            # Двигается к игроку
-            if distance > 10:
-                self.change_x = (dx / distance) * self.speed
-                self.change_y = (dy / distance) * self.speed
-
-            if self.timer >= self.interval:
-                self.shoot()
-                self.timer = 0
-                self.interval = random.uniform(0.5, 1.0)
-        else:
-            self.change_x = 0
-            self.change_y = 0
-
-        self.physics_engine.update()
+    def __init__(self, game_view, player, x, y):
+        super().__init__(game_view, player, x, y, "ufoGreen.png", 3,
+                         health=1000, speed=1.5, interval=random.uniform(0.5, 1.3), sight_range=1000,
+                         chases=True)
 
 
 class Key(arcade.Sprite):
     def __init__(self):
         super().__init__()
-        self.texture = arcade.load_texture("hud_keyGreen.png")
+        self.texture = ASSETS.texture("hud_keyGreen.png")
         self.scale = 2
         self.center_x = 100
         self.center_y = 900
@@ -557,36 +2815,32 @@ class Loot(arcade.Sprite):
         self.game_w = game_w
         self.name = name
         if self.name == 'heal':
-            self.texture = arcade.load_texture("hud_heartFull.png")
+            self.texture = ASSETS.texture("hud_heartFull.png")
             self.center_x = x
             self.center_y = y
             self.scale = 0.5
 
         if self.name == 'bomb':
-            self.texture = arcade.load_texture("bomb.png")
+            self.texture = ASSETS.texture("bomb.png")
             self.center_x = x
             self.center_y = y
             self.scale = 1
 
     def update(self, delta_time):
-        if self.name == 'heal':
-            if arcade.check_for_collision(self.game_w.player_sprite, self):
-                self.kill()
-                self.game_w.player_hp += 30
-
-        if self.name == 'bomb':
-            if arcade.check_for_collision(self.game_w.player_sprite, self):
-                self.kill()
-                self.game_w.count_bomb += 1
+        if arcade.check_for_collision(self.game_w.player_sprite, self):
+            self.kill()
+            self.game_w.events.emit(EV_PICKUP, RANDOM_LOOT.index(self.name), self.center_x, self.center_y)
 
 
-class Bomb(arcade.Sprite):
-    def __init__(self, start_x, start_y, target_x, target_y, game_w,
-                 speed=300, damage=500):
+class Bomb(PooledSprite):
+    def __init__(self, game_w):
         super().__init__()
-        self.texture = arcade.load_texture("bomb.png")
+        self.texture = ASSETS.texture("bomb.png")
         self.scale = 0.5
         self.game_w = game_w
+
+    def reset(self, start_x, start_y, target_x, target_y,
+              speed=300, damage=500):
         self.center_x = start_x
         self.center_y = start_y
         self.speed = speed
@@ -600,86 +2854,95 @@ class Bomb(arcade.Sprite):
         self.change_x = math.cos(angle) * speed
         self.change_y = math.sin(angle) * speed
         self.angle = math.degrees(-angle)
+        return self
 
     def update(self, delta_time):
         if (self.center_x < 0 or self.center_x > 4000 or
                 self.center_y < 0 or self.center_y > 4000):
-            self.remove_from_sprite_lists()
+            self.release()
+            return
 
         self.timer_boom += delta_time
 
-        self.center_x += self.change_x * delta_time
-        hit_list_x = arcade.check_for_collision_with_list(self, self.game_w.collision_list)
-        if hit_list_x:
-            for wall in hit_list_x:
+        grid = self.game_w.grid
+        # Большой delta_time дробим на подшаги не длиннее половины бомбы,
+        # чтобы она не проскочила сквозь тайл при подвисании кадра
+        distance = max(abs(self.change_x), abs(self.change_y)) * delta_time
+        substeps = max(1, math.ceil(distance / (min(self.width, self.height, grid.tile_w) / 2)))
+        step_dt = delta_time / substeps
+        for _ in range(substeps):
+            self.center_x += self.change_x * step_dt
+            if grid.overlaps_rect(self.left, self.bottom, self.right, self.top):
+                # Прижимаемся к краю клетки, в которую влетели
                 if self.change_x > 0:
-                    self.right = wall.left
+                    self.right = grid.cell_of(self.right, self.center_y)[0] * grid.tile_w
                 elif self.change_x < 0:
-                    self.left = wall.right
-
-            self.change_x *= -1
+                    self.left = (grid.cell_of(self.left, self.center_y)[0] + 1) * grid.tile_w
 
-        self.center_y += self.change_y * delta_time
-        hit_list_y = arcade.check_for_collision_with_list(self, self.game_w.collision_list)
+                self.change_x *= -1
 
-        if hit_list_y:
-            for wall in hit_list_y:
+            self.center_y += self.change_y * step_dt
+            if grid.overlaps_rect(self.left, self.bottom, self.right, self.top):
                 if self.change_y > 0:
-                    self.top = wall.bottom
+                    self.top = grid.cell_of(self.center_x, self.top)[1] * grid.tile_h
                 elif self.change_y < 0:
-                    self.bottom = wall.top
+                    self.bottom = (grid.cell_of(self.center_x, self.bottom)[1] + 1) * grid.tile_h
 
-            self.change_y *= -1
+                self.change_y *= -1
 
         if self.timer_boom > 0.8:
             self.booms()
 
     def booms(self):
-        boom = Booms(self.center_x, self.center_y, self.game_w, self)
-        self.game_w.boom_list.append(boom)
-
-        self.kill()
+        self.game_w.events.emit(EV_EXPLOSION, OWNER_IDS['player'], self.center_x, self.center_y, self.damage)
+        self.release()
 
 
-class Booms(arcade.Sprite):
-    def __init__(self, x, y, game, bomb, owner='friend'):
+class Booms(PooledSprite):
+    def __init__(self, game):
         super().__init__()
-        self.texture = arcade.make_soft_circle_texture(64, arcade.color.NEON_GREEN)
+        self.texture = ASSETS.soft_circle(BOOM_TEX_SIZE, arcade.color.NEON_GREEN)
+        self.game_w = game
+
+    def reset(self, x, y, damage, owner='friend'):
+        # Урон копируем сразу: бомба/пуля к этому моменту уже вернулась в пул
         self.center_x = x
         self.center_y = y
         self.scale = 1
-        self.game_w = game
-        self.bomb = bomb
-        self.sound = arcade.load_sound("8bit_bomb_explosion.wav")
-        self.sound.play()
+        self.alpha = 255
+        self.damage = damage
         self.owner = owner
+        self.smoke_steps = 0
+        self.game_w.events.emit(EV_SOUND, SOUND_BOOM, x, y)
+        return self
 
     def update(self, delta_time):
         self.width += 17
         self.height += 17
         self.alpha -= 10
         if self.owner == 'friend':
-            hit_list_boom = arcade.check_for_collision_with_list(self, self.game_w.enemy_list)
-            self.game_w.emitters.append(make_smoke_puff(self.center_x, self.center_y))
-            if hit_list_boom:
-                for en in hit_list_boom:
-                    en.health -= self.bomb.damage
-                    if en.health <= 0:
-                        en.kill()
+            # Взрыв игрока задевает только обычных врагов — их ищем по сетке BroadPhase шага
+            hit_list_boom = self.game_w.broadphase.query_rect(self.left, self.bottom, self.right, self.top)
+            self.smoke_steps += 1
+            if self.smoke_steps >= PARTICLE_BUDGET.smoke_every():
+                self.game_w.emitters.spawn(make_smoke_puff(self.center_x, self.center_y, self.smoke_steps))
+                self.smoke_steps = 0
+            for en in hit_list_boom:
+                if isinstance(en, Enemy) and not self.game_w.actors.lethal(en.slot):
+                    self.game_w.damage_actor(en, self.damage)
             if self.width > 400 or self.alpha <= 0:
-                self.kill()
+                self.release()
         else:
             hit_list_boom = arcade.check_for_collision_with_list(self, self.game_w.player_list)
             if hit_list_boom:
-                for pl in hit_list_boom:
-                    self.game_w.player_hp -= self.bomb.damage_boom
-                    self.kill()
+                self.game_w.events.emit(EV_DAMAGE, TARGET_PLAYER, self.center_x, self.center_y, self.damage)
+                self.release()
             if self.width > 200 or self.alpha <= 0:
-                self.kill()
+                self.release()
 
 
 class GameView(arcade.View):
-    def __init__(self):
+    def __init__(self, level_number=1):
         super().__init__()
         # Здесь спрайты, физика
         self.player_speed = 6
@@ -687,20 +2950,27 @@ class GameView(arcade.View):
         self.count_bomb = 0
         self.keys_pressed = set()
         self.close = True
-        self.emitters = []
+        self.emitters = EmitterManager()
+        PARTICLES.clear()
         self.fountain = None
         self.trail = None
         self.kd = 0
-        self.level_number = 1
-        self.shot_sound = arcade.load_sound("gunfire_sfx.wav")
-        self.enemy_dead = arcade.load_sound('explosion (1).wav')
-        self.sound = arcade.load_sound('ruskerdax_-_savage_ambush.mp3')
-        self.manager = UIManager()
-        self.anchor_layout = UIAnchorLayout()
-
-        self.setup_widgets()
-
-        self.manager.add(self.anchor_layout)
+        self.level_number = level_number
+        self.transitions = []  # Замеры смены уровней (см. LevelLoader)
+        self.sim_accumulator = 0.0  # Накопленное, но ещё не просимулированное время
+        self.sim_steps = 0
+        self.sim_dropped = 0.0  # Сколько времени выброшено из-за лимита догонялок
+        self.interpolate = True  # Рисовать игрока, камеру и пули между шагами симуляции
+        self.show_profiler = False  # F3 — оверлей с замерами, F4 — выгрузка в файл
+        self.over = False  # Игрок погиб
+        self.manager = None  # В headless надписей HP/BOMBS нет (arcade.gui не импортирован)
+        if not HEADLESS:
+            self.manager = UIManager()
+            self.anchor_layout = UIAnchorLayout()
+
+            self.setup_widgets()
+
+            self.manager.add(self.anchor_layout)
 
         self.world_camera = arcade.camera.Camera2D()  # Камера для игрового мира
         self.gui_camera = arcade.camera.Camera2D()
@@ -712,6 +2982,7 @@ class GameView(arcade.View):
         self.wall_list = arcade.SpriteList()  # Сюда попадёт слой Collision!
         self.enemy_list = arcade.SpriteList()
         self.bullet_list = arcade.SpriteList()
+        self.enemy_bullet_list = arcade.SpriteList()  # Общий список пуль всех врагов
         self.keys = arcade.SpriteList()
         self.loot_list = arcade.SpriteList()
         self.bomb_list = arcade.SpriteList()
@@ -719,7 +2990,27 @@ class GameView(arcade.View):
         self.boss_list = arcade.SpriteList()
         self.turrel_list = arcade.SpriteList()
 
-        self.player_sprite = arcade.Sprite("p1_stand.png",
+        # Пулы снарядов: в установившемся бою новые объекты не создаются
+        self.bullet_pool = SpritePool(Bullet, BULLET_POOL_SIZE)
+        self.bomb_pool = SpritePool(lambda: Bomb(self), BOMB_POOL_SIZE)
+        self.boom_pool = SpritePool(lambda: Booms(self), BOOM_POOL_SIZE)
+        self.projectiles = ProjectileEngine(BULLET_POOL_SIZE)
+        self.bullet_pool.prewarm(128)
+        self.bomb_pool.prewarm(8)
+        self.boom_pool.prewarm(16)
+        self.broadphase = BroadPhase()
+        self.actors = ActorStore(self)  # Данные врагов, боссов и турелей — в массивах
+        self.zones = ActivityZones(self.actors)
+        self.ai = AIScheduler(self.actors)
+        self.physics = WorldPhysics()  # Движение всех тел одним проходом
+        self.chunks = StaticChunks()  # Стены, сундуки, выход, двери и бочки — запечёнными кусками
+        self.tiles = TileState(self.physics, self.chunks)  # Двери, бочки, сундуки и выход — сеткой
+        self.events = EventBus()
+        self.profiler = FrameProfiler()
+        self.profiler_text = arcade.Text("", 10, SCREEN_HEIGHT - 10, arcade.color.NEON_GREEN,
+                                         font_size=12, anchor_y="top", multiline=True, width=420)
+
+        self.player_sprite = arcade.Sprite(ASSETS.texture("p1_stand.png"),
                                            0.5)
         self.player_list.append(self.player_sprite)
 
@@ -728,63 +3019,108 @@ class GameView(arcade.View):
     def setup(self):
         # ===== ВОЛШЕБСТВО ЗАГРУЗКИ КАРТЫ! (Почти без магии.) =====
         map_name = f"testik{self.level_number}.tmx"
-        tile_map = arcade.load_tilemap(map_name, scaling=TILE_SCALING)
+        started = time.perf_counter()
+        tile_map, transition = LEVELS.take(map_name)  # Обычно уже загружена в фоне
 
         # --- Достаём слои из карты как спрайт-листы ---
         self.wall_list = tile_map.sprite_lists["walls"]
-        enemy_list_0 = tile_map.sprite_lists["enemy"]
         self.chests_list = tile_map.sprite_lists["chests"]
         self.doors_list = tile_map.sprite_lists["doors"]
         self.barrel_list = tile_map.sprite_lists["barrel"]
         self.exit_list = tile_map.sprite_lists["exit"]
-        boss_list = tile_map.sprite_lists["boss"]
-        turrel_list = tile_map.sprite_lists["turrel"]
-        self.collision_list = tile_map.sprite_lists["collision"]
-        self.collision_list.use_spatial_hashing = True
-        self.collision_list.enable_spatial_hashing()
+        self.grid = tile_map.grid
+        self.projectiles.grid = self.grid
+        self.vision = LineOfSight(self.grid)
+        self.tiles.reset(self.grid, tile_map.sprite_lists)
+        self.events.clear()  # События прошлой карты ссылаются на чужие слоты
+        self.physics.reset(self.grid, self.tiles.kind == TILE_DOOR)
+        self.flow = FlowField(self.physics)
+        self.ai.reset(self.vision, self.flow)
 
         self.world_width = int(tile_map.width * tile_map.tile_width * TILE_SCALING)
         self.world_height = int(tile_map.height * tile_map.tile_height * TILE_SCALING)
+        self.projectiles.bounds = (0, 0, self.world_width, self.world_height)
+        self.chunks.reset([self.wall_list, self.chests_list, self.exit_list, self.doors_list, self.barrel_list],
+                          tile_map.width, tile_map.height,
+                          tile_map.tile_width * TILE_SCALING, tile_map.tile_height * TILE_SCALING)
 
         # Ставим игрока куда-нибудь на землю
         self.player_sprite.center_x = 128
         self.player_sprite.center_y = 128
+        self.save_render_state()
 
-        # --- Физический движок ---
-        # Используем PhysicsEngineSimple, который знаем и любим
-        self.physics_engine = arcade.PhysicsEngineSimple(
-            self.player_sprite, [self.collision_list, self.doors_list, self.boss_list]
-        )
-
-        for enemy_sprite in enemy_list_0[:]:
+        # Актёров ставим по таблицам спавна скомпилированной карты
+        for x, y in tile_map.spawns["enemy"].tolist():
             enemy = Enemy(
                 game_view=self,
                 player=self.player_sprite,
-                x=enemy_sprite.center_x,
-                y=enemy_sprite.center_y
+                x=x,
+                y=y
             )
-            enemy_sprite.remove_from_sprite_lists()
             self.enemy_list.append(enemy)
 
-        for boss_sprite in boss_list[:]:
+        for x, y in tile_map.spawns["boss"].tolist():
             boss = Boss(
                 game_view=self,
                 player=self.player_sprite,
-                x=boss_sprite.center_x,
-                y=boss_sprite.center_y
+                x=x,
+                y=y
             )
-            boss_sprite.remove_from_sprite_lists()
             self.boss_list.append(boss)
 
-        for turrel_sprite in turrel_list[:]:
+        for x, y in tile_map.spawns["turrel"].tolist():
             turrel = Turrel(
                 game_view=self,
                 player=self.player_sprite,
-                x=turrel_sprite.center_x,
-                y=turrel_sprite.center_y
+                x=x,
+                y=y
             )
-            turrel_sprite.remove_from_sprite_lists()
             self.turrel_list.append(turrel)
+        self.zones.rebuild()
+
+        # Сколько стоил переход: ожидание карты + сборка уровня в главном потоке
+        transition["setup_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        self.transitions.append(transition)
+        LEVELS.prefetch(f"testik{self.level_number + 1}.tmx")  # Пока играем — грузим следующий
+
+    def spawn_bullet(self, start_x, start_y, target_x, target_y, owner='player'):
+        bullet = self.bullet_pool.acquire()
+        if bullet is None:
+            return None
+        bullet.reset(start_x, start_y, target_x, target_y, owner=owner)
+        if owner == 'player':
+            self.bullet_list.append(bullet)
+        else:
+            self.enemy_bullet_list.append(bullet)
+        self.projectiles.add(bullet)
+        return bullet
+
+    def smash_barrel(self, barrel):
+        if not self.tiles.break_barrel(barrel):
+            return  # Уже разбита в этом шаге
+        item = random.choices(RANDOM_LOOT, weights=CHANCE, k=1)[0]
+        loot = Loot(item,
+                    barrel.center_x,
+                    barrel.center_y,
+                    self)
+        self.loot_list.append(loot)
+
+    def damage_actor(self, actor, damage):
+        # Урон применится в drain(), но смертельный учитываем сразу (см. ActorStore.lethal)
+        self.actors.pending[actor.slot] += damage
+        self.events.emit(EV_DAMAGE, actor.slot, actor.center_x, actor.center_y, damage)
+
+    def spawn_boom(self, x, y, damage, owner='friend'):
+        boom = self.boom_pool.acquire()
+        if boom is not None:
+            self.boom_list.append(boom.reset(x, y, damage, owner))
+
+    def pool_stats(self):
+        return {
+            "bullets": self.bullet_pool.stats(),
+            "bombs": self.bomb_pool.stats(),
+            "booms": self.boom_pool.stats(),
+        }
 
     def on_resize(self, width: int, height: int):
         self.world_camera.viewport = (0, 0, width, height)
@@ -817,60 +3153,149 @@ class GameView(arcade.View):
             align_y=220
         )
 
+    def save_render_state(self):
+        # Запоминаем состояние до шага, чтобы рисовать между шагами
+        self.prev_player_pos = self.player_sprite.position
+        self.prev_camera_pos = self.world_camera.position
+
     def on_draw(self):
         self.clear()
 
+        # Доля следующего шага, которая уже «натикала» в аккумуляторе
+        player_pos = self.player_sprite.position
+        camera_pos = self.world_camera.position
+        if self.interpolate:
+            alpha = self.sim_accumulator / SIM_DT
+            self.player_sprite.position = arcade.math.lerp_2d(self.prev_player_pos, player_pos, alpha)
+            self.world_camera.position = arcade.math.lerp_2d(self.prev_camera_pos, camera_pos, alpha)
+            self.projectiles.render_sync(alpha)
+
+        self.profiler.begin()
+        # Вызовы отрисовки на экран считаем там же, где их делаем (запекание чанков — отдельно, в "bakes")
+        self.profiler.count("draw_calls", 0)
+        self.chunks.bake_visible(self.world_camera)  # Перезапекаем изменившиеся чанки в кадре
         self.world_camera.use()
-        self.wall_list.draw()
-        self.chests_list.draw()
-        self.exit_list.draw()
-        if self.close:
-            self.doors_list.draw()
-        self.player_list.draw()
-        self.enemy_list.draw()
-        self.boss_list.draw()
-        self.turrel_list.draw()
-        self.bullet_list.draw()
-        self.loot_list.draw()
-        self.barrel_list.draw()
-        self.bomb_list.draw()
-        self.boom_list.draw()
-
-        for e in self.emitters:
-            e.draw()
+        self.profiler.add("draw_calls", self.chunks.draw())
+        for sprite_list in [self.player_list, self.enemy_list, self.boss_list, self.turrel_list,
+                            self.bullet_list, self.loot_list, self.bomb_list, self.boom_list]:
+            self.draw_list(sprite_list)
+        self.profiler.lap("draw_world")
 
-        for enemy in self.enemy_list:
-            enemy.bullet_list.draw()
-
-        for boss in self.boss_list:
-            boss.bullet_list.draw()
-
-        for turrel in self.turrel_list:
-            turrel.bullet_list.draw()
+        self.profiler.add("draw_calls", self.emitters.draw())
+        self.draw_list(self.enemy_bullet_list)
+        self.profiler.lap("draw_effects")
 
         self.gui_camera.use()
-        self.manager.draw()
+        if self.manager is not None:
+            self.label.text = f"HP: {self.player_hp}"
+            self.label_2.text = f"BOMBS: {self.count_bomb}"
+            self.manager.draw()
+            self.profiler.add("draw_calls")  # Виджеты рисуются в свою текстуру, на экран — одним квадратом
 
         # хпбар
         self.bar = max(0, self.player_hp / 1000)
         arcade.draw_lbwh_rectangle_filled(8, 58, 504, 54, arcade.color.BLACK)
         arcade.draw_lbwh_rectangle_filled(10, 60, 500 * self.bar, 50, arcade.color.RED)
+        self.profiler.add("draw_calls", 2)
 
         # предметы
-        self.keys.draw()
+        self.draw_list(self.keys)
+
+        if self.show_profiler:
+            self.profiler_text.y = self.window.height - 10
+            self.profiler_text.text = self.profiler.overlay_text()
+            self.profiler_text.draw()
+            self.profiler.add("draw_calls")
+        self.profiler.lap("draw_gui")
+
+        self.player_sprite.position = player_pos
+        self.world_camera.position = camera_pos
+
+        self.update_counters()
+        self.profiler.end_frame()
+
+    def draw_list(self, sprite_list):
+        # Пустой или скрытый список arcade не рисует — такой вызов и не считаем
+        if len(sprite_list) and sprite_list.visible and sprite_list.alpha:
+            sprite_list.draw()
+            self.profiler.add("draw_calls")
+
+    def update_counters(self):
+        self.profiler.count("actors", len(self.enemy_list) + len(self.boss_list) + len(self.turrel_list))
+        self.profiler.count("bullets", self.projectiles.count())
+        self.profiler.count("bombs", len(self.bomb_list) + len(self.boom_list))
+        self.profiler.count("contacts", self.physics.contacts)
+        self.profiler.count("live_emitters", len(self.emitters))
+        self.profiler.count("chunks", len(self.chunks.visible))
+        self.profiler.count("awake", self.zones.active)
+        self.profiler.count("particles", PARTICLE_BUDGET.live)
+        self.profiler.count("particle_lod", round(PARTICLE_BUDGET.lod, 2))
+        self.profiler.count("bakes", self.chunks.bakes)
+        self.profiler.count("los_rays", self.vision.rays)
+        self.profiler.count("bp_candidates", self.broadphase.candidates)
+        # Промах кэша ассетов после старта — чтение с диска посреди игры
+        self.profiler.count("asset_hits", ASSETS.hits)
+        self.profiler.count("asset_misses", ASSETS.misses)
+        # Отказы пулов: снаряд не появился, потому что пул исчерпан
+        self.profiler.count("pool_rejected", self.bullet_pool.rejected + self.bomb_pool.rejected
+                            + self.boom_pool.rejected)
+
+    def observe_particles(self, frame_ms):
+        PARTICLE_BUDGET.observe(PARTICLES.count, frame_ms)
 
     def on_update(self, dt: float):
+        self.observe_particles(dt * 1000)
+
+        # Копим реальное время и тратим его фиксированными шагами SIM_DT
+        self.sim_accumulator += dt
+        steps = 0
+        while self.sim_accumulator >= SIM_DT:
+            if steps == MAX_SIM_STEPS:
+                # Сильно отстали: не пытаемся догнать, а честно замедляемся
+                self.sim_dropped += self.sim_accumulator - self.sim_accumulator % SIM_DT
+                self.sim_accumulator %= SIM_DT
+                break
+            self.save_render_state()
+            self.simulate(SIM_DT)
+            self.sim_accumulator -= SIM_DT
+            steps += 1
+            if self.over or self.window.current_view is not self:
+                break  # Игра окончена или пауза — дальше не симулируем
+        AUDIO.update()  # Звуки всех шагов кадра — разом
+        LEVELS.pump()  # Следующий уровень — по кусочку за кадр
+
+    def simulate(self, dt):
+        # Один шаг игровой логики фиксированной длины
+        self.sim_steps += 1
+
+        self.profiler.begin()
+
         # Обновляем физику
         self.player_sprite.change_x = 0
         self.player_sprite.change_y = 0
 
-        self.enemy_list.update(dt)
-        self.bullet_list.update(dt)
-        self.loot_list.update(dt)
+        self.vision.begin_frame(self.player_sprite)
+        self.flow.update(self.player_sprite.center_x, self.player_sprite.center_y)
+        awake, dts = self.zones.update(self.player_sprite, dt)  # Дальние актёры спят
+        self.actors.step(awake, dts, self.player_sprite)
+        self.profiler.lap("enemies")
+        self.ai.run(self.player_sprite)  # Видимость и пути — в пределах бюджета шага
+        self.profiler.lap("ai")
+
+        # Все, в кого может попасть пуля или взрыв игрока, — в одну сетку на шаг.
+        # Нечем попасть — сетка не нужна. Двери и бочки не двигаются: их ищем по сетке TileState
+        if len(self.bullet_list) or any(boom.owner == 'friend' for boom in self.boom_list):
+            self.broadphase.rebuild(self.actors)
+        self.profiler.lap("broadphase")
+
+        # Пули, упёршиеся в стену, обработаем после попаданий: за шаг они могли
+        # задеть кого-то раньше, чем долетели до стены
+        wall_hits = self.projectiles.step(dt)
         self.bomb_list.update(dt)
         self.boom_list.update(dt)
-        self.boss_list.update(dt)
-        self.turrel_list.update(dt)
+        self.profiler.lap("projectiles")
+
+        self.loot_list.update(dt)
 
         if arcade.key.A in self.keys_pressed:
             self.player_sprite.change_x = -self.player_speed
@@ -885,76 +3310,70 @@ class GameView(arcade.View):
             self.player_sprite.change_x *= 0.7071
             self.player_sprite.change_y *= 0.7071
 
-        if self.trail:
-            self.trail.center_x = self.player_sprite.center_x
-            self.trail.center_y = self.player_sprite.center_y
-
         self.kd += dt
 
-        self.label.text = f"HP: {self.player_hp}"
-        self.label_2.text = f"BOMBS: {self.count_bomb}"
+        self.profiler.lap("player")
 
         # Обновляем эмиттеры и чистим «умершие»
-        emitters_copy = self.emitters.copy()  # Защищаемся от мутаций списка
-        for e in emitters_copy:
-            e.update(dt)
-        for e in emitters_copy:
-            if e.can_reap():  # Готов к уборке?
-                self.emitters.remove(e)
+        self.emitters.update(dt)
+        self.profiler.lap("emitters")
 
-        for bullet in self.bullet_list:
-            enemies_hit_list = arcade.check_for_collision_with_lists(bullet, [self.enemy_list, self.boss_list,
-                                                                              self.turrel_list])
-            barrel_hit = arcade.check_for_collision_with_list(bullet, self.barrel_list)
+        self.update_enemy_bullets()
 
-            if arcade.check_for_collision_with_lists(bullet, [self.collision_list, self.doors_list]):
-                bullet.remove_from_sprite_lists()
+        for bullet in self.bullet_list[:]:
+            x0, y0, x1, y1 = self.projectiles.segment(bullet)
+            hits = self.broadphase.query_segment(x0, y0, x1, y1, self.projectiles.radius[bullet.slot])
+            hits = [hit for hit in hits if not self.actors.lethal(hit[1].slot)]  # Обречённые пулю не ловят
+            tile_hit = self.tiles.segment_hit(x0, y0, x1, y1)
+            if not hits and tile_hit is None:
                 continue
+            barrel_hit = []
+            if tile_hit is not None:
+                tile_t, kind, tile = tile_hit
+                # Всё, что пуля задела за шаг до двери или бочки
+                hits = [hit for hit in hits if hit[0] < tile_t]
+                if kind == TILE_BARREL:
+                    barrel_hit = [tile]
+                elif not hits:  # Дверь встретилась первой
+                    bullet.release()
+                    continue
+            enemies_hit_list = [other for t, other in hits]
 
             # Если лазер попал в зомби, удаляем и лазер, и зомби
             if enemies_hit_list:
-                bullet.remove_from_sprite_lists()
+                bullet.release()
                 for enemy in enemies_hit_list:
-                    enemy.health -= bullet.damage
-                    if enemy.health <= 0:
-                        enemy.remove_from_sprite_lists()
-                        self.emitters.append(make_explosion(enemy.center_x, enemy.center_y))
-                        self.enemy_dead.play(volume=0.5)
+                    self.damage_actor(enemy, bullet.damage)
 
             # если попал в ящик
             if barrel_hit:
-                bullet.remove_from_sprite_lists()
-                for bar in barrel_hit[:]:
-                    item = random.choices(RANDOM_LOOT, weights=CHANCE, k=1)[0]
-                    loot = Loot(item,
-                                bar.center_x,
-                                bar.center_y,
-                                self)
-                    bar.remove_from_sprite_lists()
-                    self.loot_list.append(loot)
+                bullet.release()
+                for bar in barrel_hit:
+                    self.smash_barrel(bar)
+
+        for bullet in wall_hits:
+            if bullet.in_pool:
+                continue  # Уже попала в кого-то по дороге
+            # Пуля упёрлась в стену: у босса она ещё и взрывается
+            if bullet.owner == 'boss':
+                self.events.emit(EV_EXPLOSION, OWNER_IDS['boss'], bullet.center_x, bullet.center_y, bullet.damage_boom)
+            bullet.release()
         # ключики
         if self.close:
-            if arcade.check_for_collision_with_list(self.player_sprite, self.chests_list):
+            if self.tiles.touching(self.player_sprite, TILE_CHEST):
                 key = Key()
                 self.keys.append(key)
                 self.close = False
-                for door in self.doors_list[:]:
-                    door.remove_from_sprite_lists()
+                self.tiles.open_doors()
 
             # если игрок коснулся бочки
-        if arcade.check_for_collision_with_list(self.player_sprite, self.barrel_list):
-            hit = arcade.check_for_collision_with_list(self.player_sprite, self.barrel_list)
-            for barrel in hit[:]:
-                item = random.choices(RANDOM_LOOT, weights=CHANCE, k=1)[0]
-                loot = Loot(item,
-                            barrel.center_x,
-                            barrel.center_y,
-                            self)
-                barrel.remove_from_sprite_lists()
-                self.loot_list.append(loot)
+        for barrel in self.tiles.touching(self.player_sprite, TILE_BARREL):
+            self.smash_barrel(barrel)
+        self.tiles.flush()  # Открытые двери и разбитые бочки — в физику, чанки и списки
+        self.events.drain(self)  # Урон, подборы, взрывы, смерти и звуки шага — одной пачкой
 
         # вфход
-        if arcade.check_for_collision_with_list(self.player_sprite, self.exit_list):
+        if self.tiles.touching(self.player_sprite, TILE_EXIT):
             self.level_number += 1
             for loot in self.loot_list[:]:
                 loot.remove_from_sprite_lists()
@@ -966,13 +3385,19 @@ class GameView(arcade.View):
                 tur.remove_from_sprite_lists()
             for boss in self.boss_list[:]:
                 boss.remove_from_sprite_lists()
+            for bullet in self.enemy_bullet_list[:]:
+                bullet.release()
             self.close = True
             self.setup()
+        self.profiler.lap("collisions")
 
         if self.player_hp <= 0:
             self.game_over()
 
-        self.physics_engine.update()
+        # Игрок и все проснувшиеся актёры — одним проходом по сетке стен и дверей
+        self.physics.step(self.player_sprite, self.boss_list, self.actors, awake, np.rint(dts / dt))
+        self.zones.relocate(awake)
+        self.profiler.lap("physics")
 
         # камера в мире
         view_w = self.world_camera.viewport_width / self.world_camera.zoom
@@ -1002,33 +3427,46 @@ class GameView(arcade.View):
             self.window.width / 2,
             self.window.height / 2
         )
+        self.profiler.lap("camera")
+
+    def update_enemy_bullets(self):
+        # Все вражеские пули одним проходом: пуля живёт, даже если стрелок уже убит.
+        # Путь пули уже обрезан по стене в ProjectileEngine.step
+        player = self.player_sprite
+        for bullet in self.projectiles.sweep_rect(player.left, player.bottom, player.right, player.top,
+                                                  [OWNER_IDS['enemy'], OWNER_IDS['boss']]):
+            self.events.emit(EV_DAMAGE, TARGET_PLAYER, bullet.center_x, bullet.center_y, bullet.damage)
+            bullet.release()
 
     def on_mouse_press(self, x, y, button, mod):
         """Выстрел по клику мыши"""
         # ПРЕОБРАЗУЕМ экранные координаты мыши в мировые!
         world_point = self.world_camera.unproject((x, y))
-        world_x = world_point.x
-        world_y = world_point.y
+        self.fire(button, world_point.x, world_point.y)
+
+    def fire(self, button, world_x, world_y):
+        # Выстрел/бросок в точку мира (отдельно от мыши — нужно и для сценариев)
         if self.kd > 0.2:
             if button == arcade.MOUSE_BUTTON_LEFT:
-                bullet = Bullet(
+                bullet = self.spawn_bullet(
                     self.player_sprite.center_x,
                     self.player_sprite.center_y,
                     world_x, world_y,
                 )
-                self.bullet_list.append(bullet)
-                self.kd = 0
-                self.shot_sound.play(volume=0.3)
+                if bullet is not None:
+                    self.kd = 0
+                    self.events.emit(EV_SOUND, SOUND_SHOT)
         if self.count_bomb > 0:
             if button == arcade.MOUSE_BUTTON_RIGHT:
-                bomb = Bomb(
-                    self.player_sprite.center_x,
-                    self.player_sprite.center_y,
-                    world_x, world_y,
-                    self
-                )
-                self.bomb_list.append(bomb)
-                self.count_bomb -= 1
+                bomb = self.bomb_pool.acquire()
+                if bomb is not None:
+                    bomb.reset(
+                        self.player_sprite.center_x,
+                        self.player_sprite.center_y,
+                        world_x, world_y,
+                    )
+                    self.bomb_list.append(bomb)
+                    self.count_bomb -= 1
 
     def on_key_press(self, key, modifiers):
         if key == arcade.key.ESCAPE:
@@ -1037,6 +3475,11 @@ class GameView(arcade.View):
         # Другие клавиши для движения.
         self.keys_pressed.add(key)
 
+        if key == arcade.key.F3:
+            self.show_profiler = not self.show_profiler
+        if key == arcade.key.F4:
+            self.profiler.dump()
+
         if key == arcade.key.C:
             self.emitters.clear()
             self.fountain = None
@@ -1044,23 +3487,25 @@ class GameView(arcade.View):
 
         if key == arcade.key.V:
             if self.trail:
-                self.emitters.remove(self.trail)
+                self.emitters.retire(self.trail)
                 self.trail = None
             else:
-                self.trail = make_trail(self.player_sprite)
-                self.emitters.append(self.trail)
+                self.trail = self.emitters.spawn(make_trail(self.player_sprite))
 
     def on_key_release(self, key, modifiers):
         if key in self.keys_pressed:
             self.keys_pressed.remove(key)
 
     def on_show_view(self):
-        self.backgound_player = self.sound.play(loop=True, volume=0.5)
+        AUDIO.play_music(MUSIC_TRACK, volume=0.5)
 
     def on_hide_view(self):
-        arcade.stop_sound(self.backgound_player)
+        AUDIO.stop_music()
 
     def game_over(self):
+        self.over = True
+        if self.manager is None:
+            return  # Headless: экрана «игра окончена» нет, прогон сам увидит self.over
         self.manager.disable()
         game_over = GameOverView()
         self.window.show_view(game_over)
@@ -1125,19 +3570,138 @@ class PauseView(arcade.View):
             self.window.show_view(self.game_view)  # Возвращаемся в игру
 
 
+def demo_script(ticks):
+    # Сценарий по умолчанию: ходим по уровню и стреляем в разные стороны.
+    # Формат: {тик: [(действие, аргументы...)]}, координаты выстрела — от игрока.
+    script = {}
+    moves = [arcade.key.D, arcade.key.W, arcade.key.A, arcade.key.S]
+    for tick in range(0, ticks, 90):
+        key = moves[(tick // 90) % len(moves)]
+        script.setdefault(tick, []).append(("press", key))
+        script.setdefault(tick + 89, []).append(("release", key))
+    for tick in range(0, ticks, 15):
+        angle = tick * 0.1
+        script.setdefault(tick, []).append(("shoot", math.cos(angle) * 300, math.sin(angle) * 300))
+    return script
+
+
+def apply_script_action(game_view, action):
+    name, *args = action
+    player = game_view.player_sprite
+    if name == "press":
+        game_view.keys_pressed.add(args[0])
+    elif name == "release":
+        game_view.keys_pressed.discard(args[0])
+    elif name == "shoot":
+        game_view.fire(arcade.MOUSE_BUTTON_LEFT, player.center_x + args[0], player.center_y + args[1])
+    elif name == "bomb":
+        game_view.fire(arcade.MOUSE_BUTTON_RIGHT, player.center_x + args[0], player.center_y + args[1])
+
+
+def run_headless(level=1, ticks=600, seed=0, script=None, draw=False):
+    # Прогон игры без дисплея: фиксированные шаги быстрее реального времени,
+    # сценарий ввода и зафиксированный seed — результат повторяется от запуска к запуску
+    random.seed(seed)
+    window = arcade.Window(width=SCREEN_WIDTH, height=SCREEN_HEIGHT, visible=False)
+    ASSETS.preload()
+    game_view = GameView(level_number=level)
+    game_view.ai.budget_ms = None  # Бюджет по времени зависит от машины — считаем только задачи
+    window.show_view(game_view)
+    script = demo_script(ticks) if script is None else script
+
+    start = time.perf_counter()
+    ticks_done = 0
+    for tick in range(ticks):
+        for action in script.get(tick, ()):
+            apply_script_action(game_view, action)
+        # Бюджету частиц отдаём номинальное время кадра: LOD не зависит от машины,
+        # и прогон остаётся детерминированным
+        game_view.observe_particles(SIM_DT * 1000)
+        game_view.simulate(SIM_DT)
+        AUDIO.update()
+        LEVELS.pump()
+        if draw:
+            game_view.on_draw()
+        else:
+            game_view.update_counters()
+            game_view.profiler.end_frame()
+        ticks_done += 1
+        if game_view.over or window.current_view is not game_view:
+            break  # Игрока убили — дальше симулировать нечего
+    wall_time = time.perf_counter() - start
+
+    player = game_view.player_sprite
+    state = {
+        "level": game_view.level_number,
+        "player": [round(player.center_x, 2), round(player.center_y, 2)],
+        "hp": game_view.player_hp,
+        "enemies": len(game_view.enemy_list) + len(game_view.boss_list) + len(game_view.turrel_list),
+        "bullets": game_view.projectiles.count(),
+    }
+    report = {
+        "ticks": ticks_done,
+        "seed": seed,
+        "wall_time_s": round(wall_time, 3),
+        "ticks_per_s": round(ticks_done / wall_time, 1) if wall_time else None,
+        "frame_ms": game_view.profiler.percentiles(),
+        "subsystems": game_view.profiler.report(),
+        "state": state,
+        "emitters": game_view.emitters.stats(),
+        "transitions": game_view.transitions,
+        "level_cache": LEVEL_CACHE.stats(),
+        "zones": game_view.zones.stats(),
+        "ai": game_view.ai.stats(),
+        "physics": game_view.physics.stats(),
+        "tiles": game_view.tiles.stats(),
+        "events": game_view.events.stats(),
+        "audio": AUDIO.stats(),
+        "actors": game_view.actors.stats(),
+        "particles": PARTICLES.stats(),
+        "particle_budget": PARTICLE_BUDGET.stats(),
+        "chunks": game_view.chunks.stats(),
+        "projectiles": game_view.projectiles.stats(),
+        "vision": game_view.vision.stats(),
+        "broadphase": game_view.broadphase.stats(),
+        "assets": ASSETS.stats(),
+        "pools": game_view.pool_stats(),
+        # Отпечаток итогового состояния для регрессионных проверок
+        "checksum": zlib.crc32(json.dumps(state, sort_keys=True).encode()),
+    }
+    window.close()
+    return report
+
+
 def main():
     window = arcade.Window(width=1920,
                            height=1080,
                            resizable=False,
                            antialiasing=True
                            )
+    ASSETS.preload()  # Всё тяжёлое грузим до первого кадра
     menu_view = MenuView()
     window.show_view(menu_view)
     arcade.run()
 
 
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Machine Never Cry")
+    parser.add_argument("--headless", action="store_true", help="прогон без окна и отчёт по времени")
+    parser.add_argument("--level", type=int, default=1)
+    parser.add_argument("--ticks", type=int, default=600)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--draw", action="store_true", help="в headless-режиме ещё и рисовать кадры")
+    parser.add_argument("--bench-flow", action="store_true", help="бенчмарк поля путей")
+    return parser.parse_args(argv)
+
+
 if __name__ == "__main__":
-    main()
+    args = parse_args(sys.argv[1:])
+    if args.bench_flow:
+        print(bench_flow_field())
+    elif args.headless:
+        print(json.dumps(run_headless(args.level, args.ticks, args.seed, draw=args.draw), indent=2))
+    else:
+        main()
 
 
 